@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+
+"""
+Offline benchmark of a crawl cycle (`ecuagenera_bot.run_cycle`), without touching the live shop.
+
+Replays recorded product pages (in stock, out of stock, invalid ID, ObjectID-only) through a local
+flaresolverr stand-in (see `fake_flaresolverr.py`) for a generated user set in mongomock (or a local
+MongoDB via --mongo_url) and reports requests per cycle, wall time and peak RSS per user count.
+Every user count runs in its own process, so that peak RSS is not carried over.
+
+Execute via `make run_benchmark_crawl` from repo root or
+`PYTHONPATH=src/opt/ecuagenera-bot python3 bench/benchmark_crawl.py [--users 10,100,1000] [--method curl]`
+
+Requires `pip3 install -r bench/requirements.txt` (and chromium / chromedriver for --method web).
+"""
+
+import argparse
+import json
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+from fake_flaresolverr import FakeShop
+
+ITEM_KINDS = ['IN', 'OUT', 'OUT', 'OUT', 'OID', 'BAD']
+PLANS = ['free', 'basic', 'premium']
+
+
+# Returns `count` users with 1-5 wishlist items out of `item_count` distinct items
+def generate_users(count: int, item_count: int) -> list:
+    rnd = random.Random(count)
+    items = [f"{ITEM_KINDS[i % len(ITEM_KINDS)]}{i:04d}" for i in range(item_count)]
+    users = []
+    for i in range(count):
+        wishlist = rnd.sample(items, rnd.randint(1, min(5, item_count)))
+        users.append({
+            'email': f"user{i}@benchmark.com",
+            'pw': '',
+            'real_name': f"User {i}",
+            'expiry_date': '2999-12-31',
+            'config': {'wishlist': '\n'.join(wishlist), 'plan': rnd.choice(PLANS), 'auto_checkout': False},
+        })
+    return users
+
+
+# Runs one cycle for `user_count` users and returns the measurements
+def run_single(args, user_count: int) -> dict:
+    import pymongo
+
+    import ecuagenera_bot
+    from ecua_utils import db_utils
+    from ecuagenera_curl import EcuageneraCurl
+    from ecuagenera_website import EcuageneraWebsite
+
+    shop = FakeShop(args.flaresolverr_latency, args.direct_latency)
+    base_url = shop.start()
+    for cls in [EcuageneraCurl, EcuageneraWebsite]:
+        cls.product_url_object_path = f"{base_url}/epages/ecuagenera.sf/en_US/?ObjectPath=/Shops/ecuagenera/Products/"
+        cls.product_url_object_id = f"{base_url}/epages/ecuagenera.sf/en_US/?ObjectID="
+    EcuageneraWebsite.url = f"{base_url}/epages/ecuagenera.sf/en_US/?ObjectPath=/Shops/ecuagenera&ViewAction=ViewMyAccount"
+    EcuageneraCurl.flaresolverr_url = f"{base_url}/v1"
+
+    # the process-wide client of db_utils is simply replaced by the benchmark one
+    if args.mongo_url is not None:
+        db_utils.client = pymongo.MongoClient(args.mongo_url)
+    else:
+        import mongomock
+        db_utils.client = mongomock.MongoClient()
+    users_col = db_utils.get_db_col()
+    users_col.delete_many({})
+    users_col.insert_many(generate_users(user_count, args.items))
+
+    data_dir = tempfile.mkdtemp()
+    bot_args = ecuagenera_bot.get_arg_parser().parse_args(
+        ['--method', args.method, '--concurrency', str(args.concurrency),
+         '--rate_limit', '1000', '--log_level', '40', '--headless'])
+    ecuagenera_bot.setup(bot_args, {
+        'telegram_bot_token': '123456:benchmark',
+        'telegram_persistence_file': f"{data_dir}/telegram_persistence",
+        'item_index_file': f"{data_dir}/item_index.json",
+        'stock_state_file': f"{data_dir}/stock_state.json",
+        'outbox_file': f"{data_dir}/outbox.sqlite",
+        'checkpoint_file': f"{data_dir}/crawl_checkpoint.json",
+        'product_cache_file': f"{data_dir}/product_cache.sqlite",
+        'metrics_file': f"{data_dir}/ecuagenera_bot.prom",
+    })
+
+    start = time.perf_counter()
+    with EcuageneraCurl(item_index=ecuagenera_bot.item_index, rate_limiter=None,
+                        sessions=args.concurrency if args.method == 'curl' else 0, direct=not args.no_direct,
+                        product_cache=ecuagenera_bot.product_cache) as ec:
+        ecuagenera_bot.run_cycle(ec)
+    wall_time = time.perf_counter() - start
+    shop.stop()
+
+    return {
+        'users': user_count,
+        'flaresolverr_requests': shop.counts['flaresolverr'],
+        'direct_requests': shop.counts['direct'],
+        'sessions': shop.counts['sessions'],
+        'wall_time_s': round(wall_time, 2),
+        'metrics_file': f"{data_dir}/ecuagenera_bot.prom",
+        # kilobytes on linux
+        'peak_rss_mb': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+    }
+
+
+if __name__ == '__main__':
+    PARSER = argparse.ArgumentParser()
+    PARSER.add_argument('--users', type=str, help='Comma-separated user counts',
+                        default='10,100,1000', required=False)
+    PARSER.add_argument('--items', type=int, help='Number of distinct items',
+                        default=60, required=False)
+    PARSER.add_argument('--method', type=str, help='Method to run (web;curl)',
+                        default='curl', required=False)
+    PARSER.add_argument('--concurrency', type=int, help='Number of items to fetch in parallel (curl)',
+                        default=3, required=False)
+    PARSER.add_argument('--flaresolverr_latency', type=float, help='Simulated seconds per flaresolverr request',
+                        default=0.2, required=False)
+    PARSER.add_argument('--direct_latency', type=float, help='Simulated seconds per direct request',
+                        default=0.01, required=False)
+    PARSER.add_argument('--no_direct', help='Disable the direct HTTP path',
+                        required=False, action='store_true')
+    PARSER.add_argument('--mongo_url', type=str, help='Local MongoDB instead of mongomock (collection is cleared!)',
+                        required=False)
+    PARSER.add_argument('--single', type=int, help=argparse.SUPPRESS, required=False)
+    ARGS = PARSER.parse_args()
+
+    if ARGS.single is not None:
+        print(json.dumps(run_single(ARGS, ARGS.single)))
+        sys.exit(0)
+
+    results = []
+    for user_count in [int(count) for count in ARGS.users.split(',')]:
+        output = subprocess.check_output(
+            [sys.executable, __file__, '--single', str(user_count)] + sys.argv[1:])
+        results.append(json.loads(output.decode().strip().splitlines()[-1]))
+
+    columns = ['users', 'flaresolverr_requests', 'direct_requests',
+               'sessions', 'wall_time_s', 'peak_rss_mb']
+    print(' | '.join(columns))
+    for result in results:
+        print(' | '.join(str(result[column]).rjust(len(column)) for column in columns))
@@ -0,0 +1,61 @@
+#!/usr/bin/env python3
+
+"""
+Benchmark of the product page parser against saved product pages.
+
+Compares `ecua_utils.product_parser` with the previous lxml based parsing (full DOM + XPath),
+if lxml is installed, and checks that both extract the same name and price.
+
+Execute via `make run_benchmark_parser` from repo root or
+`PYTHONPATH=src/opt/ecuagenera-bot python3 bench/benchmark_parser.py [--pages <dir>]`
+"""
+
+import argparse
+import glob
+import os
+import timeit
+
+from ecua_utils.product_parser import parse_product_page
+
+try:
+    from lxml import etree
+except ImportError:
+    etree = None
+
+
+# The parsing as done before `product_parser` existed
+def parse_product_page_lxml(html: str) -> dict:
+    html_dom = etree.HTML(html, etree.HTMLParser())
+    name = html_dom.xpath("//*[@itemprop='name']/text()")
+    price = html_dom.xpath("//*[@itemprop='price']/@content")
+    return {'name': name[0].strip() if len(name) > 0 else None,
+            'available': "Out of stock" not in html,
+            'price': price[0] if len(price) > 0 else None}
+
+
+if __name__ == '__main__':
+    PARSER = argparse.ArgumentParser()
+    PARSER.add_argument('--pages', type=str, help='Directory with saved product pages (*.html)',
+                        default=f'{os.path.dirname(os.path.realpath(__file__))}/pages', required=False)
+    PARSER.add_argument('--number', type=int,
+                        help='Number of parses per page', default=200, required=False)
+    ARGS = PARSER.parse_args()
+
+    for page_path in sorted(glob.glob(f'{ARGS.pages}/*.html')):
+        with open(page_path, 'r') as f:
+            html = f.read()
+
+        product = parse_product_page(html)
+        regex_time = timeit.timeit(
+            lambda: parse_product_page(html), number=ARGS.number) / ARGS.number
+        print(f"{os.path.basename(page_path)}: {product}")
+        print(f"  product_parser: {regex_time * 1000:.3f} ms/page")
+
+        if etree is not None:
+            product_lxml = parse_product_page_lxml(html)
+            lxml_time = timeit.timeit(
+                lambda: parse_product_page_lxml(html), number=ARGS.number) / ARGS.number
+            print(f"  lxml:           {lxml_time * 1000:.3f} ms/page ({lxml_time / regex_time:.1f}x slower)")
+            for key in ['name', 'price']:
+                if product[key] != product_lxml[key]:
+                    print(f"  MISMATCH {key}: {product[key]} != {product_lxml[key]}")
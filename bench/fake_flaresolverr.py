@@ -0,0 +1,103 @@
+"""
+Local stand-in for flaresolverr and the ecuagenera.com shop, serving recorded product pages.
+
+The kind of page is derived from the item ID prefix:
+
+* `IN...`: in stock
+* `OUT...`: out of stock
+* `OID...`: out of stock, but only resolvable via ObjectID (ObjectPath is not available)
+* anything else (e.g. `BAD...`): not available (invalid ID)
+
+Product pages can be requested via flaresolverr (`POST /v1`) or directly (`GET /epages/...`),
+so that both the flaresolverr and the direct HTTP path of `EcuageneraCurl` can be measured.
+"""
+
+import json
+import os
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+PAGES_DIR = f'{os.path.dirname(os.path.realpath(__file__))}/pages'
+
+
+class FakeShop:
+    def __init__(self, flaresolverr_latency: float = 0.2, direct_latency: float = 0.01):
+        self.flaresolverr_latency = flaresolverr_latency
+        self.direct_latency = direct_latency
+        self.lock = threading.Lock()
+        self.counts = {'flaresolverr': 0, 'direct': 0, 'sessions': 0}
+        self.pages = {}
+        for name in ['in_stock', 'out_of_stock', 'not_available', 'sign_in']:
+            with open(f'{PAGES_DIR}/{name}.html', 'r') as f:
+                self.pages[name] = f.read()
+
+    def count(self, key: str):
+        with self.lock:
+            self.counts[key] += 1
+
+    # Returns the page for a shop URL
+    def get_page(self, url: str) -> str:
+        query = parse_qs(urlparse(url).query)
+        if 'ViewAction' in query:
+            return self.pages['sign_in']
+        if 'ObjectID' in query:
+            item_id = query['ObjectID'][0]
+        else:
+            item_id = query.get('ObjectPath', [''])[0].split('/')[-1]
+            if item_id.startswith('OID'):
+                return self.pages['not_available']
+        if item_id.startswith('IN'):
+            return self.pages['in_stock']
+        if item_id.startswith('OUT') or item_id.startswith('OID'):
+            return self.pages['out_of_stock']
+        return self.pages['not_available']
+
+    # Starts the server in a background thread and returns its base URL
+    def start(self) -> str:
+        shop = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, format, *args):
+                pass
+
+            def reply(self, body: str, content_type: str):
+                data = body.encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_GET(self):
+                shop.count('direct')
+                time.sleep(shop.direct_latency)
+                self.reply(shop.get_page(self.path), 'text/html')
+
+            def do_POST(self):
+                payload = json.loads(self.rfile.read(
+                    int(self.headers['Content-Length'])))
+                response = {'status': 'ok'}
+                if payload['cmd'] == 'sessions.create':
+                    shop.count('sessions')
+                    response['session'] = str(uuid.uuid4())
+                elif payload['cmd'] == 'request.get':
+                    shop.count('flaresolverr')
+                    time.sleep(shop.flaresolverr_latency)
+                    response['solution'] = {
+                        'url': payload['url'],
+                        'status': 200,
+                        'response': shop.get_page(payload['url']),
+                        'cookies': [{'name': 'cf_clearance', 'value': 'benchmark', 'domain': '127.0.0.1', 'path': '/'}],
+                        'userAgent': 'Mozilla/5.0 (benchmark)',
+                    }
+                self.reply(json.dumps(response), 'application/json')
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return f'http://127.0.0.1:{self.server.server_port}'
+
+    def stop(self):
+        self.server.shutdown()
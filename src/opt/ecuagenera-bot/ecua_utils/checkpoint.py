@@ -0,0 +1,66 @@
+import time
+
+from .json_store import JsonStore
+
+
+class CrawlCheckpoint(JsonStore):
+    """Persisted progress of the current crawl cycle, so that an interrupted cycle resumes where it stopped.
+
+    Holds the `method` and `started` time of the cycle, the products fetched so far (`products`), the users
+    which were already handled (`users_done`, email -> time) and the failures of the cycle (`failures`).
+    The checkpoint is cleared once a cycle completes. A checkpoint which is not `persistent` is only kept
+    in memory (e.g. for runs of a single user, which must not touch the progress of the full cycle).
+    """
+
+    def __init__(self, path: str, persistent: bool = True):
+        self.persistent = persistent
+        super().__init__(path)
+
+    def load(self):
+        if self.persistent:
+            super().load()
+
+    def save(self):
+        if self.persistent:
+            super().save()
+
+    # Starts a new cycle, or resumes the last one if it was interrupted less than `max_age` seconds ago.
+    # Returns True if the cycle is resumed
+    def start(self, method: str, max_age: float, now: float = None) -> bool:
+        now = now or time.time()
+        with self.lock:
+            started = self.get('started')
+            if started is not None and self.get('method') == method and now - started < max_age:
+                return True
+            self.data = {'method': method, 'started': now,
+                         'products': {}, 'users_done': {}, 'failures': []}
+            return False
+
+    def get_products(self) -> dict:
+        return self.get('products', {})
+
+    def add_product(self, product: dict):
+        with self.lock:
+            self.data['products'][product['id']] = product
+
+    def is_user_done(self, email: str) -> bool:
+        with self.lock:
+            return email in self.data['users_done']
+
+    def set_user_done(self, email: str):
+        with self.lock:
+            self.data['users_done'][email] = time.time()
+
+    # Records a failed item or user (`kind`), which is retried if the cycle gets resumed
+    def add_failure(self, kind: str, key: str, error: Exception):
+        with self.lock:
+            self.data['failures'].append({'kind': kind, 'key': key, 'error': repr(error),
+                                          'time': time.time()})
+
+    def get_failures(self) -> list:
+        return self.get('failures', [])
+
+    def complete(self):
+        with self.lock:
+            self.data = {}
+        self.save()
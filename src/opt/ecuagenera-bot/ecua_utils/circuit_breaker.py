@@ -0,0 +1,81 @@
+import threading
+import time
+
+from . import metrics
+from .logger import Logger
+
+logger = Logger.logger
+
+STATE_CLOSED = 'closed'
+STATE_OPEN = 'open'
+STATE_HALF_OPEN = 'half_open'
+
+
+class CircuitOpenError(Exception):
+    pass
+
+
+class CircuitBreaker:
+    """Thread-safe circuit breaker, which stops calls after `failure_threshold` consecutive failures.
+
+    While open, calls are rejected for `reset_timeout` seconds. Afterwards a single probe call is let through
+    (half open): if it succeeds the circuit closes again, otherwise it re-opens with twice the timeout
+    (up to `max_reset_timeout`).
+    """
+
+    def __init__(self, name: str, failure_threshold: int = 5, reset_timeout: float = 30, max_reset_timeout: float = 900):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.max_reset_timeout = max_reset_timeout
+        self.lock = threading.Lock()
+        self.state = STATE_CLOSED
+        self.failures = 0
+        self.timeout = reset_timeout
+        self.opened_at = 0
+        self.probing = False
+        self.set_state(STATE_CLOSED)
+
+    def set_state(self, state: str):
+        if state != self.state:
+            logger.warning(f"Circuit {self.name} is {state}")
+        self.state = state
+        metrics.set_gauge('ecuagenera_circuit_open', 0 if state == STATE_CLOSED else 1,
+                          {'circuit': self.name})
+
+    # Returns True if a call may be made (and then has to be reported via `record_success` / `record_failure`)
+    def allow(self) -> bool:
+        with self.lock:
+            if self.state == STATE_CLOSED:
+                return True
+            if self.state == STATE_OPEN and time.monotonic() - self.opened_at >= self.timeout:
+                self.set_state(STATE_HALF_OPEN)
+            if self.state == STATE_HALF_OPEN and not self.probing:
+                self.probing = True
+                return True
+            return False
+
+    # Like `allow`, but raises CircuitOpenError instead of returning False
+    def check(self):
+        if not self.allow():
+            metrics.inc('ecuagenera_circuit_rejected_total', {'circuit': self.name})
+            raise CircuitOpenError(f"Circuit {self.name} is open")
+
+    def record_success(self):
+        with self.lock:
+            self.failures = 0
+            self.timeout = self.reset_timeout
+            self.probing = False
+            self.set_state(STATE_CLOSED)
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            if self.state == STATE_HALF_OPEN:
+                # the probe failed - back off exponentially
+                self.timeout = min(self.timeout * 2, self.max_reset_timeout)
+            elif self.state == STATE_OPEN or self.failures < self.failure_threshold:
+                return
+            self.probing = False
+            self.opened_at = time.monotonic()
+            self.set_state(STATE_OPEN)
@@ -0,0 +1,37 @@
+from .db_utils import Config
+
+
+# Returns the value of a config key (e.g. `Config.WISHLIST`) of a user or the default
+def get_user_config_value(user: dict, key: str, default=None):
+    if 'config' in user.keys() and key in user['config'].keys():
+        return user['config'][key]
+    return default
+
+
+# Returns a list of (item_id, quantity) tuples of a wishlist (quantity is None if not set)
+def parse_wishlist(wishlist: str) -> list:
+    items = []
+    if wishlist is None or wishlist == '' or wishlist == 'na':
+        return items
+    for wishlist_item in wishlist.splitlines():
+        wishlist_item = wishlist_item.strip()
+        if wishlist_item == '':
+            continue
+        item_id = wishlist_item
+        quantity = None
+        if ';' in wishlist_item:
+            item_id = wishlist_item.split(';')[0]
+            quantity = wishlist_item.split(';')[1]
+        items.append((item_id, quantity))
+    return items
+
+
+# Returns a dict of item_id -> list of subscribed users (union of all wishlists),
+# so that every distinct item has to be fetched only once per crawl cycle
+def plan_crawl(users: list) -> dict:
+    subscribers = {}
+    for user in users:
+        wishlist = get_user_config_value(user, Config.WISHLIST, '')
+        for item_id, _ in parse_wishlist(wishlist):
+            subscribers.setdefault(item_id, []).append(user)
+    return subscribers
@@ -1,14 +1,40 @@
+import datetime
+import threading
+
 import pymongo
+from . import metrics
 from .util import reload_config_yml
 
+# process-wide client (which holds the connection pool), created lazily by `get_db_client()`
+client = None
+client_lock = threading.Lock()
+
+
+# Returns the process-wide `MongoClient`, creating it on first use.
+# The pool size can be configured via `mongo_pool_size` in config.yml
+def get_db_client() -> pymongo.MongoClient:
+    global client
+    with client_lock:
+        if client is None:
+            config = reload_config_yml()
+            client = pymongo.MongoClient(
+                f"mongodb+srv://{config['mongo_user']}:{config['mongo_pw']}@{config['mongo_url']}",
+                maxPoolSize=config.get('mongo_pool_size', 10))
+        return client
+
+
+# Closes the process-wide `MongoClient` (a new one is created on next use)
+def close_db_client():
+    global client
+    with client_lock:
+        if client is not None:
+            client.close()
+            client = None
+
 
 # Returns `db` collection instance
 def get_db_col():
-    config = reload_config_yml()
-    # get user list from DB
-    client = pymongo.MongoClient(
-        f"mongodb+srv://{config['mongo_user']}:{config['mongo_pw']}@{config['mongo_url']}")
-    db = client["db"]
+    db = get_db_client()["db"]
     users_col = db["users"]
     return users_col
 
@@ -17,7 +43,26 @@ def get_db_col():
 # More information about filters can be found in https://docs.mongodb.com/manual/tutorial/project-fields-from-query-results
 def get_db_users(filter={}, projection=None) -> list:
     users_col = get_db_col()
-    return list(users_col.find(filter, projection))
+    with metrics.timed('ecuagenera_db', {'op': 'get_users'}):
+        return list(users_col.find(filter, projection))
+
+
+# Returns a cursor over all users the crawler has to run for (optionally only `email`):
+# users with a non-empty wishlist and a non-expired account, projected to the fields the crawler needs
+def get_crawler_users(email: str = None) -> pymongo.cursor.Cursor:
+    filter = {
+        f"config.{Config.WISHLIST}": {'$exists': True, '$nin': ['', 'na']},
+        '$or': [
+            {'expiry_date': {'$exists': False}},
+            # dates are stored as `%Y-%m-%d`, hence can be compared as strings
+            {'expiry_date': {'$gte': datetime.datetime.utcnow().strftime('%Y-%m-%d')}},
+        ],
+    }
+    if email is not None:
+        filter['email'] = email
+    projection = ['email', 'pw', 'expiry_date', 'telegram_chat_id', f"config.{Config.WISHLIST}",
+                  f"config.{Config.PLAN}", f"config.{Config.AUTO_CHECKOUT}"]
+    return get_db_col().find(filter, projection)
 
 
 # Returns a list of a given field (e.g. `username`) of all users in the collection
@@ -29,18 +74,89 @@ def get_db_users_field(field, filter={}, projection=None):
     return list
 
 
-def set_user_config(user: dict, config: str, value: any) -> bool:
+# Creates the indexes used for user lookups (idempotent, can be called on every startup)
+def ensure_db_indexes() -> bool:
+    col = get_db_col()
+    try:
+        col.create_index("email", unique=True)
+        return True
+    except pymongo.errors.OperationFailure as e:
+        # e.g. duplicate emails in the collection - lookups still work, just without the index
+        print(f"Could not create unique index on email: {e}")
+        return False
+
+
+# Returns the user with the given email or None
+def get_user_by_email(email: str, projection=None):
+    return get_db_col().find_one({'email': email}, projection)
+
+
+# Returns the user with the given `_id` or None
+def get_user_by_id(user_id, projection=None):
+    return get_db_col().find_one({'_id': user_id}, projection)
+
+
+# Returns the `$set` document for config keys (e.g. `Config.PLAN`) and top-level fields (e.g. `expiry_date`)
+def get_user_update(config: dict = None, fields: dict = None) -> dict:
+    update = {}
+    for key, value in (config or {}).items():
+        update[f"config.{key}"] = value
+    update.update(fields or {})
+    return update
+
+
+# Applies multiple config / field changes of one user in a single (atomic) `update_one`
+def update_user(user: dict, config: dict = None, fields: dict = None) -> bool:
     col = get_db_col()
-    result = col.update_one({'_id': user['_id']}, {
-                            '$set': {f"config.{config}": value}})
+    with metrics.timed('ecuagenera_db', {'op': 'update_user'}):
+        result = col.update_one({'_id': user['_id']}, {
+                                '$set': get_user_update(config, fields)})
     return result.acknowledged
 
+
+def set_user_config(user: dict, config: str, value: any) -> bool:
+    return update_user(user, config={config: value})
+
+
 def set_user_expiry_date(user: dict, value: str) -> bool:
+    return update_user(user, fields={"expiry_date": value})
+
+
+# Stores the Telegram chat ID linked to a user (None removes the link)
+def set_user_telegram_chat_id(email: str, chat_id) -> bool:
     col = get_db_col()
-    result = col.update_one({'_id': user['_id']}, {
-                            '$set': {"expiry_date": value}})
+    if chat_id is None:
+        update = {'$unset': {'telegram_chat_id': ''}}
+    else:
+        update = {'$set': {'telegram_chat_id': chat_id}}
+    result = col.update_one({'email': email}, update)
     return result.acknowledged
 
+
+class UserUpdateBatch:
+    """Collects user changes (e.g. of a crawl cycle) and writes them with one `bulk_write`."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.updates = {}
+
+    def add(self, user: dict, config: dict = None, fields: dict = None):
+        with self.lock:
+            self.updates.setdefault(user['_id'], {}).update(
+                get_user_update(config, fields))
+
+    def flush(self) -> bool:
+        with self.lock:
+            if len(self.updates) == 0:
+                return True
+            requests = [pymongo.UpdateOne({'_id': user_id}, {'$set': update})
+                        for user_id, update in self.updates.items()]
+            with metrics.timed('ecuagenera_db', {'op': 'bulk_write'}):
+                result = get_db_col().bulk_write(requests, ordered=False)
+            self.updates = {}
+            return result.acknowledged
+
+
 class Config:
     AUTO_CHECKOUT = "auto_checkout"
     WISHLIST = "wishlist"
@@ -0,0 +1,38 @@
+import time
+
+from .json_store import JsonStore
+
+URL_STYLE_OBJECT_PATH = "object_path"
+URL_STYLE_OBJECT_ID = "object_id"
+URL_STYLE_INVALID = "invalid"
+URL_STYLES = [URL_STYLE_OBJECT_PATH, URL_STYLE_OBJECT_ID]
+
+
+class ItemIndex(JsonStore):
+    """Remembers which URL style (ObjectPath / ObjectID) resolved an item ID last time.
+
+    IDs which resolved under neither style are stored as negative entries and are
+    skipped until `invalid_ttl` (seconds) has passed, in case the item appears later.
+    """
+
+    def __init__(self, path: str, invalid_ttl: int = 7 * 24 * 3600):
+        self.invalid_ttl = invalid_ttl
+        super().__init__(path)
+
+    # Returns the URL styles to try for an item in order (empty if known to be invalid)
+    def get_url_styles(self, item_id: str) -> list:
+        entry = self.get(item_id)
+        if entry is None:
+            return list(URL_STYLES)
+        if entry['style'] == URL_STYLE_INVALID:
+            if time.time() - entry['checked'] < self.invalid_ttl:
+                return []
+            return list(URL_STYLES)
+        return [entry['style']] + [style for style in URL_STYLES if style != entry['style']]
+
+    def set_url_style(self, item_id: str, style: str):
+        entry = self.get(item_id)
+        # avoid rewriting unchanged entries
+        if entry is not None and entry['style'] == style and style != URL_STYLE_INVALID:
+            return
+        self.set(item_id, {'style': style, 'checked': time.time()})
@@ -0,0 +1,47 @@
+import json
+import os
+import threading
+
+
+class JsonStore:
+    """Small thread-safe key/value store which is persisted as JSON file."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.lock = threading.RLock()
+        self.data = {}
+        self.load()
+
+    def load(self):
+        with self.lock:
+            self.data = {}
+            if not os.path.isfile(self.path):
+                return
+            try:
+                with open(self.path, 'r') as f:
+                    self.data = json.load(f)
+            except (OSError, ValueError) as e:
+                print(f"Could not load {self.path} - starting empty: {e}")
+
+    def get(self, key: str, default=None):
+        with self.lock:
+            return self.data.get(key, default)
+
+    def set(self, key: str, value):
+        with self.lock:
+            self.data[key] = value
+
+    def delete(self, key: str):
+        with self.lock:
+            self.data.pop(key, None)
+
+    # Writes to a temporary file first, so that a crash never leaves a half-written store
+    def save(self):
+        with self.lock:
+            tmp_path = f"{self.path}.tmp"
+            try:
+                with open(tmp_path, 'w') as f:
+                    json.dump(self.data, f)
+                os.replace(tmp_path, self.path)
+            except OSError as e:
+                print(f"Could not save {self.path}: {e}")
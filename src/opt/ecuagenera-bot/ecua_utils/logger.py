@@ -1,9 +1,12 @@
 import logging
+import os
 import sys
 from datetime import datetime
 from logging import FileHandler
 
 logFormatter = logging.Formatter('%(asctime)s [%(levelname)s] %(message)s')
+# created by the Debian package (might not exist e.g. for offline benchmarks)
+logDir = "/var/log/ecuagenera-bot"
 
 
 class Logger:
@@ -14,10 +17,11 @@ class Logger:
     ch.setFormatter(logFormatter)
     logger.addHandler(ch)
 
-    fh = FileHandler(
-        f"/var/log/ecuagenera-bot/ecuagenera_bot_{datetime.today().strftime('%Y-%m-%d_%H-%M')}.log")
-    fh.setFormatter(logFormatter)
-    logger.addHandler(fh)
+    if os.path.isdir(logDir):
+        fh = FileHandler(
+            f"{logDir}/ecuagenera_bot_{datetime.today().strftime('%Y-%m-%d_%H-%M')}.log")
+        fh.setFormatter(logFormatter)
+        logger.addHandler(fh)
 
 
 class TelegramLogger:
@@ -28,7 +32,7 @@ class TelegramLogger:
     ch.setFormatter(logFormatter)
     logger.addHandler(ch)
 
-    fh = FileHandler(
-        "/var/log/ecuagenera-bot/telegram_bot.log")
-    fh.setFormatter(logFormatter)
-    logger.addHandler(fh)
+    if os.path.isdir(logDir):
+        fh = FileHandler(f"{logDir}/telegram_bot.log")
+        fh.setFormatter(logFormatter)
+        logger.addHandler(fh)
@@ -0,0 +1,123 @@
+"""
+Minimal process-wide metrics (counters, gauges, latency histograms) in Prometheus text format.
+
+Exported either as file for the node-exporter textfile collector (`write_textfile`) or
+via a small HTTP endpoint (`start_http_server`), e.g. in daemon mode.
+"""
+
+import os
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+BUCKETS = [0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60]
+
+lock = threading.Lock()
+counters = {}
+gauges = {}
+# name -> labels -> [bucket counts..., sum, count]
+histograms = {}
+
+
+def get_key(labels: dict) -> tuple:
+    return tuple(sorted((labels or {}).items()))
+
+
+def inc(name: str, labels: dict = None, value: float = 1):
+    with lock:
+        series = counters.setdefault(name, {})
+        key = get_key(labels)
+        series[key] = series.get(key, 0) + value
+
+
+def set_gauge(name: str, value: float, labels: dict = None):
+    with lock:
+        gauges.setdefault(name, {})[get_key(labels)] = value
+
+
+def observe(name: str, value: float, labels: dict = None):
+    with lock:
+        series = histograms.setdefault(name, {})
+        values = series.setdefault(get_key(labels), [0] * (len(BUCKETS) + 2))
+        for i, bucket in enumerate(BUCKETS):
+            if value <= bucket:
+                values[i] += 1
+        values[-2] += value
+        values[-1] += 1
+
+
+# Records count and latency (`<name>_seconds`) of the wrapped code and errors (`<name>_errors_total`)
+# in case it raises an exception
+@contextmanager
+def timed(name: str, labels: dict = None):
+    start = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        inc(f"{name}_errors_total", labels)
+        raise
+    finally:
+        observe(f"{name}_seconds", time.perf_counter() - start, labels)
+
+
+def format_labels(key: tuple, extra: dict = None) -> str:
+    items = list(key) + list((extra or {}).items())
+    if len(items) == 0:
+        return ''
+    return '{' + ','.join(f'{k}="{v}"' for k, v in items) + '}'
+
+
+# Returns all metrics in Prometheus text format
+def render() -> str:
+    lines = []
+    with lock:
+        for name, series in sorted(counters.items()):
+            lines.append(f"# TYPE {name} counter")
+            for key, value in series.items():
+                lines.append(f"{name}{format_labels(key)} {value}")
+        for name, series in sorted(gauges.items()):
+            lines.append(f"# TYPE {name} gauge")
+            for key, value in series.items():
+                lines.append(f"{name}{format_labels(key)} {value}")
+        for name, series in sorted(histograms.items()):
+            lines.append(f"# TYPE {name} histogram")
+            for key, values in series.items():
+                for i, bucket in enumerate(BUCKETS):
+                    lines.append(
+                        f"{name}_bucket{format_labels(key, {'le': bucket})} {values[i]}")
+                lines.append(
+                    f"{name}_bucket{format_labels(key, {'le': '+Inf'})} {values[-1]}")
+                lines.append(f"{name}_sum{format_labels(key)} {values[-2]}")
+                lines.append(f"{name}_count{format_labels(key)} {values[-1]}")
+    return '\n'.join(lines) + '\n'
+
+
+# Writes all metrics to a `.prom` file (atomically, as the textfile collector might read it any time)
+def write_textfile(path: str):
+    tmp_path = f"{path}.tmp"
+    try:
+        with open(tmp_path, 'w') as f:
+            f.write(render())
+        os.replace(tmp_path, path)
+    except OSError as e:
+        print(f"Could not write metrics to {path}: {e}")
+
+
+# Serves all metrics on http://<host>:<port>/metrics in a background thread
+def start_http_server(port: int, host: str = '') -> ThreadingHTTPServer:
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, format, *args):
+            pass
+
+        def do_GET(self):
+            data = render().encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
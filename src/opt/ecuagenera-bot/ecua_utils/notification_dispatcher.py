@@ -0,0 +1,148 @@
+import queue
+import threading
+import time
+
+from telegram.error import BadRequest, NetworkError, RetryAfter, Unauthorized
+
+from . import metrics
+from .logger import Logger
+from .rate_limiter import RateLimiter
+
+STATUS_PENDING = 'pending'
+STATUS_DELIVERED = 'delivered'
+STATUS_BLOCKED = 'blocked'
+STATUS_FAILED = 'failed'
+
+
+class NotificationDispatcher:
+    """Sends Telegram messages from a queue with a few worker threads, so that the crawl never waits for Telegram.
+
+    Sending is limited to `rate` messages per second in total (Telegram allows ~30/s per bot), flood control
+    (`RetryAfter`) pauses all workers and transient network errors are retried with exponential backoff.
+    The delivery status of each message is kept in `statuses` (key -> status) and in the `outbox` (if any).
+    The `bot` should have a connection pool with (at least) one connection per worker.
+    """
+
+    max_retries = 5
+    retry_backoff = 2
+
+    def __init__(self, bot, workers: int = 4, rate: float = 25, outbox=None, logger=None):
+        self.bot = bot
+        self.outbox = outbox
+        self.logger = logger or Logger.logger
+        self.worker_count = workers
+        self.rate_limiter = RateLimiter(rate=rate, burst=workers)
+        self.queue = queue.Queue()
+        self.workers = []
+        self.lock = threading.Lock()
+        self.statuses = {}
+        # monotonic time until which Telegram asked us to stop sending
+        self.paused_until = 0
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def start(self):
+        for _ in range(self.worker_count):
+            worker = threading.Thread(target=self.run_worker, daemon=True)
+            worker.start()
+            self.workers.append(worker)
+
+    # Queues a message. `on_delivered(status)` is called from a worker thread once the message was
+    # delivered or the user blocked the bot (i.e. there is no point in sending it again)
+    def enqueue(self, key: str, chat_id, text: str, on_delivered=None):
+        with self.lock:
+            self.statuses[key] = STATUS_PENDING
+        self.queue.put({'key': key, 'chat_id': chat_id, 'text': text,
+                        'on_delivered': on_delivered, 'attempts': 0})
+
+    # Blocks until all queued messages are sent (or given up) and returns the number of messages per status
+    def drain(self) -> dict:
+        self.queue.join()
+        with self.lock:
+            summary = {}
+            for status in self.statuses.values():
+                summary[status] = summary.get(status, 0) + 1
+            self.statuses = {}
+        return summary
+
+    def close(self):
+        self.drain()
+        for _ in self.workers:
+            self.queue.put(None)
+        for worker in self.workers:
+            worker.join()
+        self.workers = []
+
+    def run_worker(self):
+        while True:
+            notification = self.queue.get()
+            try:
+                if notification is None:
+                    return
+                self.deliver(notification)
+            except Exception as e:
+                self.logger.error(
+                    f"Could not send Telegram message to {notification['key']}: {e}")
+                self.set_status(notification, STATUS_FAILED)
+            finally:
+                self.queue.task_done()
+
+    def set_status(self, notification: dict, status: str):
+        with self.lock:
+            self.statuses[notification['key']] = status
+        if self.outbox is not None:
+            self.outbox.set_status(notification['key'], status)
+        metrics.inc('ecuagenera_notifications_total', {'status': status})
+        if status in [STATUS_DELIVERED, STATUS_BLOCKED] and notification['on_delivered'] is not None:
+            # the message is sent - an error of the callback must not mark it as failed (and re-send it)
+            try:
+                notification['on_delivered'](status)
+            except Exception as e:
+                self.logger.error(
+                    f"Could not record delivery of Telegram message to {notification['key']}: {e}")
+
+    def deliver(self, notification: dict):
+        while True:
+            wait = self.paused_until - time.monotonic()
+            if wait > 0:
+                time.sleep(wait)
+            self.rate_limiter.acquire('telegram')
+            try:
+                with metrics.timed('ecuagenera_telegram_send'):
+                    self.bot.send_message(
+                        chat_id=notification['chat_id'], text=notification['text'])
+                self.set_status(notification, STATUS_DELIVERED)
+                return
+            except Unauthorized:
+                self.logger.info(
+                    f"User {notification['key']} has blocked Telegram bot")
+                self.set_status(notification, STATUS_BLOCKED)
+                return
+            except RetryAfter as e:
+                # flood control applies to the whole bot, so every worker backs off
+                self.logger.warning(
+                    f"Telegram flood control - retrying in {e.retry_after}s")
+                metrics.inc('ecuagenera_telegram_retries_total', {'reason': 'retry_after'})
+                with self.lock:
+                    self.paused_until = max(
+                        self.paused_until, time.monotonic() + e.retry_after)
+            except BadRequest as e:
+                # (a subclass of NetworkError, but sending it again won't help)
+                self.logger.error(
+                    f"Telegram rejected message to {notification['key']}: {e}")
+                self.set_status(notification, STATUS_FAILED)
+                return
+            except NetworkError as e:
+                notification['attempts'] += 1
+                if notification['attempts'] > self.max_retries:
+                    self.logger.error(
+                        f"Giving up sending Telegram message to {notification['key']}: {e}")
+                    self.set_status(notification, STATUS_FAILED)
+                    return
+                metrics.inc('ecuagenera_telegram_retries_total', {'reason': 'network'})
+                time.sleep(self.retry_backoff ** notification['attempts'])
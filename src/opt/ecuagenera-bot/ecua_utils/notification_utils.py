@@ -1,7 +1,10 @@
+import os
 import smtplib
 import socket
 from email.message import EmailMessage
 
+from telegram.ext import PicklePersistence
+
 from .util import reload_config_yml
 
 
@@ -39,3 +42,16 @@ def send_email(mail_body, to_email_address, subject):
                 # This exception is raised when the server unexpectedly disconnects,
                 # or when an attempt is made to use the SMTP instance before connecting it to a server
                 pass
+
+
+# Returns a dict of email -> Telegram chat ID of all accounts linked in the Telegram persistence file
+def get_telegram_chat_ids(persistence_file: str) -> dict:
+    chat_ids = {}
+    if not os.path.exists(persistence_file):
+        return chat_ids
+    persistence = PicklePersistence(filename=persistence_file)
+    for telegram_id, dataset in persistence.get_user_data().items():
+        email = dataset.get(telegram_id)
+        if email is not None:
+            chat_ids[email] = telegram_id
+    return chat_ids
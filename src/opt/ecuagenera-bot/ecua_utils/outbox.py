@@ -0,0 +1,78 @@
+import json
+import sqlite3
+import threading
+import time
+
+from .notification_dispatcher import STATUS_FAILED, STATUS_PENDING
+
+
+class Outbox:
+    """Persisted notifications (SQLite), written before sending and updated once delivered.
+
+    Each notification has an idempotency key, so that a notification is not sent again after a crash
+    (the key already exists) and pending notifications of a crashed run can be replayed on startup.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.lock = threading.Lock()
+        # shared by the crawl and the dispatcher workers (serialized by the lock)
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        with self.lock, self.conn:
+            self.conn.execute("""CREATE TABLE IF NOT EXISTS notifications (
+                key TEXT PRIMARY KEY,
+                email TEXT NOT NULL,
+                chat_id INTEGER NOT NULL,
+                text TEXT NOT NULL,
+                item_ids TEXT NOT NULL,
+                status TEXT NOT NULL,
+                created REAL NOT NULL,
+                updated REAL NOT NULL)""")
+            self.conn.execute(
+                "CREATE INDEX IF NOT EXISTS notifications_status ON notifications (status)")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    # Writes a new pending notification and returns None, or returns the status of the existing notification
+    # with the same key (failed ones are set to pending again, as they are going to be re-sent)
+    def add(self, key: str, email: str, chat_id, text: str, item_ids: list):
+        now = time.time()
+        with self.lock, self.conn:
+            row = self.conn.execute(
+                "SELECT status FROM notifications WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.conn.execute("INSERT INTO notifications VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                                  (key, email, chat_id, text, json.dumps(item_ids), STATUS_PENDING, now, now))
+                return None
+            if row[0] == STATUS_FAILED:
+                self.conn.execute("UPDATE notifications SET status = ?, text = ?, updated = ? WHERE key = ?",
+                                  (STATUS_PENDING, text, now, key))
+            return row[0]
+
+    def set_status(self, key: str, status: str):
+        with self.lock, self.conn:
+            self.conn.execute("UPDATE notifications SET status = ?, updated = ? WHERE key = ?",
+                              (status, time.time(), key))
+
+    # Returns all notifications which have not been sent yet (e.g. because the last run crashed)
+    def get_pending(self) -> list:
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT key, email, chat_id, text, item_ids FROM notifications WHERE status = ? ORDER BY created",
+                (STATUS_PENDING,)).fetchall()
+        return [{'key': key, 'email': email, 'chat_id': chat_id, 'text': text, 'item_ids': json.loads(item_ids)}
+                for key, email, chat_id, text, item_ids in rows]
+
+    # Removes notifications which are older than `max_age` seconds
+    def prune(self, max_age: float):
+        with self.lock, self.conn:
+            self.conn.execute("DELETE FROM notifications WHERE updated < ?",
+                              (time.time() - max_age,))
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
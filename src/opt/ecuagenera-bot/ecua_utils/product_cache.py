@@ -0,0 +1,96 @@
+import json
+import sqlite3
+import threading
+import time
+
+FIELDS = ['name', 'url', 'url_style', 'etag', 'last_modified',
+          'available', 'price', 'quantities']
+
+
+class ProductCache:
+    """Persisted product data per item ID (SQLite), shared by the crawler and the Telegram bot.
+
+    Holds the name, canonical URL and URL style of each item, the HTTP validators (`etag`, `last_modified`)
+    of its page for conditional requests and the last seen stock (`available`, `price`, `quantities`).
+    Entries older than `ttl` seconds are ignored, the least recently used ones are evicted beyond `max_entries`.
+    """
+
+    def __init__(self, path: str, ttl: float = 30 * 24 * 3600, max_entries: int = 10000):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        # shared by the fetch threads (serialized by the lock)
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        with self.lock, self.conn:
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.execute("""CREATE TABLE IF NOT EXISTS products (
+                item_id TEXT PRIMARY KEY,
+                name TEXT,
+                url TEXT,
+                url_style TEXT,
+                etag TEXT,
+                last_modified TEXT,
+                available INTEGER,
+                price TEXT,
+                quantities TEXT,
+                updated REAL NOT NULL,
+                accessed REAL NOT NULL)""")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    # Returns the cached entry of an item (dict with FIELDS) or None if there is none or it expired
+    def get(self, item_id: str):
+        now = time.time()
+        with self.lock, self.conn:
+            row = self.conn.execute(f"SELECT {', '.join(FIELDS)} FROM products WHERE item_id = ? AND updated >= ?",
+                                    (item_id, now - self.ttl)).fetchone()
+            if row is None:
+                return None
+            self.conn.execute(
+                "UPDATE products SET accessed = ? WHERE item_id = ?", (now, item_id))
+        entry = dict(zip(FIELDS, row))
+        entry['available'] = bool(entry['available'])
+        entry['quantities'] = json.loads(entry['quantities'] or '[]')
+        return entry
+
+    # Returns a dict of item_id -> name of all given items which are cached
+    def get_names(self, item_ids: list) -> dict:
+        if len(item_ids) == 0:
+            return {}
+        with self.lock:
+            rows = self.conn.execute(
+                f"SELECT item_id, name FROM products WHERE item_id IN ({', '.join('?' * len(item_ids))}) "
+                "AND updated >= ? AND name IS NOT NULL",
+                list(item_ids) + [time.time() - self.ttl]).fetchall()
+        return dict(rows)
+
+    # Stores (some of) the FIELDS of an item, fields which are not given are kept
+    def put(self, item_id: str, **fields):
+        now = time.time()
+        if 'quantities' in fields:
+            fields['quantities'] = json.dumps(fields['quantities'])
+        columns = [field for field in FIELDS if field in fields]
+        with self.lock, self.conn:
+            self.conn.execute("INSERT OR IGNORE INTO products (item_id, updated, accessed) VALUES (?, ?, ?)",
+                              (item_id, now, now))
+            self.conn.execute(f"UPDATE products SET {''.join(f'{column} = ?, ' for column in columns)}"
+                              "updated = ?, accessed = ? WHERE item_id = ?",
+                              [fields[column] for column in columns] + [now, now, item_id])
+
+    # Removes expired entries and the least recently used ones beyond `max_entries`
+    def evict(self):
+        with self.lock, self.conn:
+            self.conn.execute("DELETE FROM products WHERE updated < ?",
+                              (time.time() - self.ttl,))
+            self.conn.execute("DELETE FROM products WHERE item_id IN "
+                              "(SELECT item_id FROM products ORDER BY accessed DESC LIMIT -1 OFFSET ?)",
+                              (self.max_entries,))
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
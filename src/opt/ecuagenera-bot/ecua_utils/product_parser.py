@@ -0,0 +1,58 @@
+"""
+Fast extraction of product information from ecuagenera.com (ePages) product pages.
+
+Instead of building a complete DOM, a few targeted regular expressions are run over the
+decoded html, which is several times cheaper per page (see `bench/benchmark_parser.py`).
+"""
+
+import html as html_lib
+import re
+
+# patterns start with a literal (not `<[^>]*`), so that the regex engine can skip ahead quickly
+NAME_RE = re.compile(r'itemprop=["\']name["\'][^>]*>([^<]*)<')
+PRICE_RE = re.compile(r'itemprop=["\']price["\']')
+CONTENT_ATTR_RE = re.compile(r'content=["\']([^"\']*)["\']')
+QUANTITY_SELECT_RE = re.compile(
+    r'<select[^>]*name=["\']Quantity["\'][^>]*>(.*?)</select>', re.DOTALL)
+OPTION_VALUE_RE = re.compile(r'<option[^>]*value=["\']([^"\']*)["\']')
+
+PRODUCT_MARKER = "ProductDetails"
+IN_STOCK_MARKER = "ProductOnStockIcon"
+NOT_AVAILABLE_MARKER = "The page requested is not available."
+
+
+# Returns True if the html is a product page (and not e.g. a maintenance, sign-in or error page)
+def is_product_page(html: str) -> bool:
+    return PRODUCT_MARKER in html or NAME_RE.search(html) is not None
+
+
+# Returns a dict with `valid` (is a product page), `name`, `available`, `price` and `quantities` (orderable
+# quantities) of a product page. Values which can't be found are None (name, price) or empty (quantities)
+def parse_product_page(html: str) -> dict:
+    product = {'valid': False, 'name': None, 'available': False,
+               'price': None, 'quantities': []}
+    if NOT_AVAILABLE_MARKER in html or not is_product_page(html):
+        return product
+    product['valid'] = True
+
+    name = NAME_RE.search(html)
+    if name is not None:
+        product['name'] = html_lib.unescape(name.group(1)).strip()
+
+    # only in stock if the stock icon says so (like the web method)
+    product['available'] = IN_STOCK_MARKER in html
+
+    # the content attribute can be before or after itemprop, hence search the whole tag
+    price_attr = PRICE_RE.search(html)
+    if price_attr is not None:
+        price_tag = html[html.rfind('<', 0, price_attr.start()):html.find('>', price_attr.end())]
+        price = CONTENT_ATTR_RE.search(price_tag)
+        if price is not None:
+            product['price'] = price.group(1)
+
+    quantity_select = QUANTITY_SELECT_RE.search(html)
+    if quantity_select is not None:
+        product['quantities'] = OPTION_VALUE_RE.findall(
+            quantity_select.group(1))
+
+    return product
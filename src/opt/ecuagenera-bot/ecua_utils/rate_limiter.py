@@ -0,0 +1,29 @@
+import threading
+import time
+
+
+class RateLimiter:
+    """Thread-safe token bucket, with one bucket per key (e.g. host name).
+
+    `rate` is the number of allowed calls per second, `burst` the bucket size.
+    """
+
+    def __init__(self, rate: float, burst: int = 1):
+        self.rate = rate
+        self.burst = burst
+        self.lock = threading.Lock()
+        self.buckets = {}
+
+    # Blocks until a call for `key` is allowed
+    def acquire(self, key: str = 'default'):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                tokens, last = self.buckets.get(key, (self.burst, now))
+                tokens = min(self.burst, tokens + (now - last) * self.rate)
+                if tokens >= 1:
+                    self.buckets[key] = (tokens - 1, now)
+                    return
+                self.buckets[key] = (tokens, now)
+                wait = (1 - tokens) / self.rate
+            time.sleep(wait)
@@ -0,0 +1,98 @@
+import random
+import time
+
+from .crawl_utils import get_user_config_value
+from .db_utils import Config
+
+PLAN_PRIORITIES = {'premium': 3, 'basic': 2, 'free': 1}
+
+# minutes between two checks of an item per priority tier (can be overwritten via
+# `poll_intervals_minutes` in config.yml), i.e. premium items are checked every cycle
+POLL_INTERVALS = {'premium': 0, 'basic': 10, 'free': 25}
+
+# max. minutes between two checks of items which have not been restocked for a long time
+# (can be overwritten via `max_backoff` in `poll_intervals_minutes`)
+MAX_BACKOFF = 120
+
+
+# Returns the priority of a user based on plan (premium > basic > free) and auto-checkout
+def get_user_priority(user: dict) -> int:
+    priority = PLAN_PRIORITIES.get(
+        get_user_config_value(user, Config.PLAN, 'free'), 1)
+    if priority == PLAN_PRIORITIES['premium'] and get_user_config_value(user, Config.AUTO_CHECKOUT, False):
+        priority += 1
+    return priority
+
+
+# Returns the polling priority of an item: the highest priority of its subscribers,
+# raised for items which have been restocked before
+def get_item_priority(subscribers: list, stock_entry: dict = None) -> float:
+    priority = max([get_user_priority(user) for user in subscribers] + [0])
+    if stock_entry is not None:
+        priority += min(stock_entry.get('restocks', 0), 2) * 0.5
+    return priority
+
+
+# Returns the poll interval (minutes) of a priority
+def get_poll_interval(priority: float, poll_intervals: dict = POLL_INTERVALS) -> float:
+    if priority >= PLAN_PRIORITIES['premium']:
+        return poll_intervals.get('premium', POLL_INTERVALS['premium'])
+    if priority >= PLAN_PRIORITIES['basic']:
+        return poll_intervals.get('basic', POLL_INTERVALS['basic'])
+    return poll_intervals.get('free', POLL_INTERVALS['free'])
+
+
+# Returns True if `now` is within an hour of a weekday / hour at which the item was restocked before
+def is_in_restock_window(stock_entry: dict, now: float) -> bool:
+    now_tm = time.gmtime(now)
+    for restock_time in stock_entry.get('restock_times', []):
+        restock_tm = time.gmtime(restock_time)
+        hour_diff = abs(now_tm.tm_hour - restock_tm.tm_hour)
+        if now_tm.tm_wday == restock_tm.tm_wday and min(hour_diff, 24 - hour_diff) <= 1:
+            return True
+    return False
+
+
+# Returns the poll interval (minutes) of an item adapted to its restock history:
+# every cycle around observed restock windows, backing off for items which are out of stock for long
+def get_adaptive_interval(interval: float, stock_entry: dict, now: float, max_backoff: float = MAX_BACKOFF) -> float:
+    if is_in_restock_window(stock_entry, now):
+        return 0
+    if stock_entry.get('available'):
+        return interval
+    restock_times = stock_entry.get('restock_times', [])
+    last_change = restock_times[-1] if len(restock_times) > 0 else stock_entry.get('first_seen', now)
+    # +30 minutes per week without restock
+    dormant_weeks = (now - last_change) // (7 * 24 * 3600)
+    return max(interval, min(dormant_weeks * 30, max_backoff))
+
+
+# Returns True if an item has to be checked in this cycle (10% grace, as cycles never start exactly on time)
+def is_item_due(priority: float, stock_entry: dict, poll_intervals: dict = POLL_INTERVALS, now: float = None) -> bool:
+    if stock_entry is None or stock_entry.get('last_seen') is None:
+        return True
+    now = now or time.time()
+    interval = get_poll_interval(priority, poll_intervals)
+    # premium items are checked every cycle as promised, i.e. never backed off
+    if priority < PLAN_PRIORITIES['premium']:
+        interval = get_adaptive_interval(interval, stock_entry, now,
+                                         poll_intervals.get('max_backoff', MAX_BACKOFF))
+    return now - stock_entry['last_seen'] >= interval * 60 * 0.9
+
+
+# Returns the item IDs to check in this cycle, highest priority first
+def schedule_items(subscribers: dict, stock_state, poll_intervals: dict = POLL_INTERVALS) -> list:
+    priorities = {}
+    for item_id, users in subscribers.items():
+        stock_entry = stock_state.get(item_id)
+        priority = get_item_priority(users, stock_entry)
+        if is_item_due(priority, stock_entry, poll_intervals):
+            priorities[item_id] = priority
+    return sorted(priorities.keys(), key=lambda item_id: priorities[item_id], reverse=True)
+
+
+# Sorts users by priority (highest first), shuffled within the same priority so everyone gets their turn
+def sort_users(users: list) -> list:
+    users = list(users)
+    random.shuffle(users)
+    return sorted(users, key=get_user_priority, reverse=True)
@@ -0,0 +1,61 @@
+import time
+
+from .json_store import JsonStore
+
+MAX_RESTOCK_TIMES = 20
+
+
+class StockState(JsonStore):
+    """Persisted stock state per item ID, used to notify users only on stock transitions.
+
+    Each entry holds the last seen state (`available`, `last_seen`), the time the item was
+    first seen in stock (`in_stock_since`), the restock history (`restocks`, `restock_times`,
+    `first_seen`) and when each user was last notified (`notified`).
+    """
+
+    # Records an observation of an item and returns True if it just came (back) in stock
+    def update_item(self, item_id: str, available: bool, now: float = None) -> bool:
+        now = now or time.time()
+        with self.lock:
+            entry = self.get(item_id, {'available': False, 'in_stock_since': None,
+                                       'last_seen': None, 'notified': {}})
+            entry.setdefault('first_seen', now)
+            restocked = available and not entry['available']
+            if restocked:
+                entry['in_stock_since'] = now
+                entry['restocks'] = entry.get('restocks', 0) + 1
+                # keep the latest restock times to detect restock windows (weekday / hour)
+                entry['restock_times'] = (entry.get('restock_times', []) + [now])[-MAX_RESTOCK_TIMES:]
+            elif not available:
+                entry['in_stock_since'] = None
+                entry['notified'] = {}
+            entry['available'] = available
+            entry['last_seen'] = now
+            self.set(item_id, entry)
+            return restocked
+
+    # Returns True if the user has to be notified about an item, i.e. if it is in stock and the user
+    # has not been notified since it came in stock or not within the last `renotify_interval` seconds
+    def should_notify(self, item_id: str, email: str, renotify_interval: float, now: float = None) -> bool:
+        now = now or time.time()
+        entry = self.get(item_id)
+        if entry is None or not entry['available']:
+            return False
+        last_notified = entry['notified'].get(email)
+        if last_notified is None or last_notified < entry['in_stock_since']:
+            return True
+        return now - last_notified >= renotify_interval
+
+    # Returns a key which identifies a notification about an item for a user: it changes when the item comes
+    # in stock again and after each notification, but stays the same until the notification was recorded
+    def get_notification_key(self, item_id: str, email: str) -> str:
+        entry = self.get(item_id)
+        if entry is None:
+            return f"{item_id}@None/None"
+        return f"{item_id}@{entry['in_stock_since']}/{entry['notified'].get(email)}"
+
+    def set_notified(self, item_id: str, email: str, now: float = None):
+        with self.lock:
+            entry = self.get(item_id)
+            if entry is not None:
+                entry['notified'][email] = now or time.time()
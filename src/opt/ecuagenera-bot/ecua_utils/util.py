@@ -50,3 +50,8 @@ def chunks(lst, n):
     """Yield successive n-sized chunks from lst."""
     for i in range(0, len(lst), n):
         yield lst[i:i + n]
+
+
+# Returns the path of a data file (e.g. caches, state) stored next to config.yml
+def get_data_file_path(file_name: str) -> str:
+    return f'{os.path.dirname(os.path.realpath(__file__))}/../{file_name}'
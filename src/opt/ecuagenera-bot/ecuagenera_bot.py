@@ -1,6 +1,5 @@
 import argparse
 import datetime
-import os
 import platform
 import random
 import smtplib
@@ -8,22 +7,47 @@ import socket
 import sys
 import time
 import traceback
+from concurrent.futures import ThreadPoolExecutor
 from email.message import EmailMessage
 
 import yaml
 from telegram import Bot
-from telegram.error import Unauthorized
-from telegram.ext import PicklePersistence
-
-from ecua_utils.db_utils import (Config, get_db_users, get_db_users_field,
-                                 set_user_config, set_user_expiry_date)
+from telegram.utils.request import Request
+
+from ecua_utils import metrics
+from ecua_utils.checkpoint import CrawlCheckpoint
+from ecua_utils.circuit_breaker import CircuitBreaker
+from ecua_utils.crawl_utils import (get_user_config_value, parse_wishlist,
+                                    plan_crawl)
+from ecua_utils.db_utils import (Config, UserUpdateBatch, close_db_client,
+                                 get_crawler_users)
+from ecua_utils.item_index import ItemIndex
 from ecua_utils.logger import Logger
-from ecua_utils.util import reload_config_yml
+from ecua_utils.notification_dispatcher import (STATUS_BLOCKED,
+                                                STATUS_DELIVERED,
+                                                STATUS_PENDING,
+                                                NotificationDispatcher)
+from ecua_utils.notification_utils import get_telegram_chat_ids
+from ecua_utils.outbox import Outbox
+from ecua_utils.product_cache import ProductCache
+from ecua_utils.rate_limiter import RateLimiter
+from ecua_utils.scheduler import POLL_INTERVALS, schedule_items, sort_users
+from ecua_utils.stock_state import StockState
+from ecua_utils.util import get_data_file_path, reload_config_yml
 from ecuagenera_curl import EcuageneraCurl
-from ecuagenera_website import EcuageneraWebsite
+from ecuagenera_website import BrowserPool, EcuageneraWebsite
+
+
+# number of users after which the cycle progress is saved
+CHECKPOINT_EVERY = 10
 
 
-def inform_user_if_item_available(user, mail_body):
+# Queues the Telegram message for the user (sent by the notification dispatcher). The items are
+# marked as notified once the message got delivered, so that failed messages are retried next cycle
+def inform_user_if_item_available(user, mail_body, item_ids=()):
+    email = user['email']
+    set_notified = get_set_notified(email, item_ids)
+
     # step 1: check for user expiry date and add message if account expires within 7 days
     if 'expiry_date' in user.keys():
         user_expiry_date = datetime.datetime.strptime(
@@ -37,120 +61,173 @@ def inform_user_if_item_available(user, mail_body):
             mail_body += "Please extend via Telegram bot (https://telegram.me/ecuagenera_bot) by typing '/extendbasic' or '/extendpremium'."
 
     # step 2: send telegram message (if registered)
-    if os.path.exists(config['telegram_persistence_file']):
-        persistence = PicklePersistence(
-            filename=config['telegram_persistence_file'])
-        for i, (telegram_id, dataset) in enumerate(persistence.get_user_data().items()):
-            dataset_cdc_user = dataset.get(telegram_id)
-            if dataset_cdc_user is not None and email in dataset_cdc_user:
-                logger.debug(
-                    f"User {email} has linked telegram account ({telegram_id})")
-                bot = Bot(config['telegram_bot_token'])
-                try:
-                    bot.send_message(chat_id=telegram_id, text=mail_body)
-                except Unauthorized:
-                    logger.debug(
-                        f"User {email} has blocked Telegram bot")
-                    pass
+    telegram_id = get_telegram_chat_id(user)
+    if telegram_id is not None:
+        logger.debug(
+            f"User {email} has linked telegram account ({telegram_id})")
+        # write to the outbox before sending, so that a crash neither loses nor duplicates the notification
+        key = f"{email}|" + ",".join(sorted(
+            stock_state.get_notification_key(item_id, email) for item_id in item_ids))
+        status = outbox.add(key, email, telegram_id, mail_body, list(item_ids))
+        if status in [STATUS_DELIVERED, STATUS_BLOCKED]:
+            logger.debug(f"User {email} has already been notified ({status})")
+            set_notified()
+        elif status == STATUS_PENDING:
+            logger.debug(f"Notification for user {email} is already queued")
+        else:
+            dispatcher.enqueue(key, telegram_id, mail_body,
+                               on_delivered=set_notified)
+    else:
+        set_notified()
+
+
+# Returns a callback which marks the items as notified for a user
+def get_set_notified(email, item_ids):
+    def set_notified(status=None):
+        for item_id in item_ids:
+            stock_state.set_notified(item_id, email)
+    return set_notified
+
+
+# Queues the notifications which were not sent by a previous (crashed) run
+def replay_outbox():
+    pending = outbox.get_pending()
+    if len(pending) > 0:
+        logger.info(f"Replaying {len(pending)} pending notifications")
+    for notification in pending:
+        dispatcher.enqueue(notification['key'], notification['chat_id'], notification['text'],
+                           on_delivered=get_set_notified(notification['email'], notification['item_ids']))
+
+
+# Returns the linked Telegram chat ID of a user or None.
+# Users linked before the chat ID was stored in the DB are looked up in the
+# Telegram persistence file, which is loaded only once per run
+def get_telegram_chat_id(user):
+    global telegram_chat_ids
+    if 'telegram_chat_id' in user.keys():
+        return user['telegram_chat_id']
+    if telegram_chat_ids is None:
+        telegram_chat_ids = get_telegram_chat_ids(
+            config['telegram_persistence_file'])
+    return telegram_chat_ids.get(user['email'])
+
+
+# Fetches every distinct item once and returns a dict of item_id -> product snapshot
+# (in parallel with up to `concurrency` workers). Items which fail are left out and recorded
+def fetch_products(ec, item_ids, concurrency=1) -> dict:
+    products = {}
+    # drop snapshots of the previous cycle (daemon mode)
+    ec.products.clear()
+
+    def fetch_product(item_id):
+        try:
+            return ec.fetch_product(item_id)
+        except Exception as e:
+            logger.error(f"Could not fetch item {item_id}: {e}")
+            logger.debug(traceback.format_exc())
+            metrics.inc('ecuagenera_cycle_failures_total', {'kind': 'item'})
+            checkpoint.add_failure('item', item_id, e)
+            return None
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        for product in executor.map(fetch_product, item_ids):
+            if product is None:
+                continue
+            products[product['id']] = product
+            checkpoint.add_product(product)
+            logger.info(
+                f"Item {product['id']} is {'in stock' if product['available'] else 'not in stock'}")
+            if product['valid']:
+                stock_state.update_item(product['id'], product['available'])
+            elif product['not_found']:
+                # clears a stale in stock state (e.g. the item was removed from the shop)
+                stock_state.update_item(product['id'], False)
+    return products
 
 
-def run_curl(user):
+def run_curl(user, products):
     inform_user = False
     mail_body = ''
 
     # get some config data
-    wishlist = ''
-    auto_checkout = False
-    user_plan = ''
-    if 'config' in user.keys():
-        if Config.AUTO_CHECKOUT in user['config'].keys():
-            auto_checkout = user['config'][Config.AUTO_CHECKOUT]
-        if Config.PLAN in user['config'].keys():
-            user_plan = user['config'][Config.PLAN]
-        if Config.WISHLIST in user['config'].keys():
-            wishlist = user['config'][Config.WISHLIST]
+    wishlist = get_user_config_value(user, Config.WISHLIST, '')
+    auto_checkout = get_user_config_value(user, Config.AUTO_CHECKOUT, False)
+    user_plan = get_user_config_value(user, Config.PLAN, '')
 
     if wishlist == '' or wishlist == 'na':
         logger.debug("User has no items in wishlist. Exit early")
         return
 
-    # Step 1: Gather item availability information from website
-    with EcuageneraCurl(username=user['email'], password=user['pw'], headless=headless) as ec:
-        # login only if checkout is enabled
-        # TBD tell user that basket is cleared every 5mins
-        # if auto_checkout:
-        #     if user['pw'] != '':
-        #         ew.login()
-        #         ew.clear_basket()
-        #     else:
-        #         logger.warning('Could not auto-checkout because user did not provide pw')
-
-        available_items = {}
-        available_ordered_items = []
-        for i, wishlist_item in enumerate(wishlist.splitlines()):
-            item_id = wishlist_item
-            quantity = None
-            if ';' in wishlist_item:
-                item_id = wishlist_item.split(';')[0]
-                quantity = wishlist_item.split(';')[1]
-            ec.get_item_name(item_id)
-            if ec.is_item_available(item_id):
-                logger.info(f"Item {item_id} is in stock")
-                available_items[item_id] = ec.get_item_name(item_id)
-                if quantity is not None:
-                    available_ordered_items.append(item_id)
-                    ec.add_to_basket(quantity=quantity)
-            else:
-                logger.info(f"Item {item_id} is not in stock")
-
-        if len(available_items) == 0:
-            logger.info("No item is available yet")
-            return
-
-        mail_body += f"The following items are now available in ecuagenera.com:\n\n"
-
-        for i, (item_id, item_name) in enumerate(available_items.items(), start=1):
-            mail_body += f"- #{i}: {item_name} (ID: {item_id})\n"
-
-        # if auto_checkout:
-        #     if user['pw'] != '':
-        #         # do checkout
-        #         logger.debug('Trying to checkout')
-        #         if ec.checkout():
-        #             mail_body += "\nThe following items have been checked out, but not been paid for yet:\n\n"
-
-        #             # remove ordered items from wishlist and update db
-        #             # TODO: confirm if they really were ordered
-        #             new_wishlist = ''
-        #             for old_wishlist_line in wishlist.splitlines():
-        #                 old_wishlist_item = old_wishlist_line
-        #                 if ";" in old_wishlist_item:
-        #                     old_wishlist_item = old_wishlist_line.split(';')[0]
-        #                 if old_wishlist_item in available_ordered_items:
-        #                     mail_body += f"- {old_wishlist_item}\n"
-        #                     continue
-        #                 else:
-        #                     new_wishlist += f"{old_wishlist_line}\n"
-        #             new_wishlist = new_wishlist.strip()
-        #             logger.debug(
-        #                 f'Attempting to update database entry {Config.WISHLIST} for user {email}:\n{new_wishlist}')
-        #             set_user_config(user, Config.WISHLIST, new_wishlist)
-        #             mail_body += "\nPlease proceed to pay by sending an email to the ecuagenera.com team."
-        #             mail_body += "\n\nHint: You should have received an email with the invoice from ecuagenera.com."
-        #         else:
-        #             logger.warning("Tried to checkout but it failed")
-        #     else:
-        #         logger.warning('Could not auto-checkout because user did not provide pw')
+    # Step 1: Gather item availability information from the products fetched in this cycle
+    # login only if checkout is enabled
+    # TBD tell user that basket is cleared every 5mins
+    # if auto_checkout:
+    #     if user['pw'] != '':
+    #         ew.login()
+    #         ew.clear_basket()
+    #     else:
+    #         logger.warning('Could not auto-checkout because user did not provide pw')
+
+    available_items = {}
+    available_ordered_items = []
+    for item_id, quantity in parse_wishlist(wishlist):
+        product = products.get(item_id)
+        # only notify about items which are in stock in this cycle and came in stock since the last notification
+        if product is not None and product['valid'] and product['available'] and \
+                stock_state.should_notify(item_id, user['email'], renotify_interval):
+            available_items[item_id] = product['name']
+            if quantity is not None:
+                available_ordered_items.append(item_id)
+
+    if len(available_items) == 0:
+        logger.info("No new item is available yet")
+        return
 
-        inform_user = True
+    mail_body += f"The following items are now available in ecuagenera.com:\n\n"
+
+    for i, (item_id, item_name) in enumerate(available_items.items(), start=1):
+        mail_body += f"- #{i}: {item_name} (ID: {item_id})\n"
+
+    # if auto_checkout:
+    #     if user['pw'] != '':
+    #         # do checkout
+    #         logger.debug('Trying to checkout')
+    #         if ec.checkout():
+    #             mail_body += "\nThe following items have been checked out, but not been paid for yet:\n\n"
+
+    #             # remove ordered items from wishlist and update db
+    #             # TODO: confirm if they really were ordered
+    #             new_wishlist = ''
+    #             for old_wishlist_line in wishlist.splitlines():
+    #                 old_wishlist_item = old_wishlist_line
+    #                 if ";" in old_wishlist_item:
+    #                     old_wishlist_item = old_wishlist_line.split(';')[0]
+    #                 if old_wishlist_item in available_ordered_items:
+    #                     mail_body += f"- {old_wishlist_item}\n"
+    #                     continue
+    #                 else:
+    #                     new_wishlist += f"{old_wishlist_line}\n"
+    #             new_wishlist = new_wishlist.strip()
+    #             logger.debug(
+    #                 f'Attempting to update database entry {Config.WISHLIST} for user {email}:\n{new_wishlist}')
+    #             user_updates.add(user, config={Config.WISHLIST: new_wishlist})
+    #             mail_body += "\nPlease proceed to pay by sending an email to the ecuagenera.com team."
+    #             mail_body += "\n\nHint: You should have received an email with the invoice from ecuagenera.com."
+    #         else:
+    #             logger.warning("Tried to checkout but it failed")
+    #     else:
+    #         logger.warning('Could not auto-checkout because user did not provide pw')
+
+    inform_user = True
 
     # Step 2: Send Telegram message if necessary
     logger.info(mail_body)
     if inform_user:
-        inform_user_if_item_available(user, mail_body)
+        inform_user_if_item_available(
+            user, mail_body, list(available_items.keys()))
 
 
-def run_web(user, headless):
+def run_web(user, headless, browser_pools=None):
     inform_user = False
     mail_body = ''
 
@@ -170,8 +247,15 @@ def run_web(user, headless):
         logger.info("User has no items in wishlist. Exit early")
         return
 
+    # the lean browser profile is enough for stock checks, login / checkout need the full one
+    lean = not auto_checkout
+    browser_pool = None
+    if browser_pools is not None:
+        browser_pool = browser_pools['lean' if lean else 'full']
+
     # Step 1: Gather item availability information from website
-    with EcuageneraWebsite(username=user['email'], password=user['pw'], headless=headless) as ew:
+    with EcuageneraWebsite(username=user['email'], password=user['pw'], headless=headless, item_index=item_index, pool=browser_pool, lean=lean,
+                           product_cache=product_cache) as ew:
         ew.open_website()
 
         # login only if checkout is enabled
@@ -194,15 +278,19 @@ def run_web(user, headless):
                 quantity = wishlist_item.split(';')[1]
             if ew.is_item_available(item_id):
                 logger.info(f"Item {item_id} is in stock")
-                available_items[item_id] = ew.get_item_name(item_id)
+                stock_state.update_item(item_id, True)
+                # only notify about items which came in stock since the last notification (or are checked out)
+                if (auto_checkout and quantity is not None) or stock_state.should_notify(item_id, user['email'], renotify_interval):
+                    available_items[item_id] = ew.get_item_name(item_id)
                 if quantity is not None:
                     available_ordered_items.append(item_id)
                     ew.add_to_basket(quantity=quantity)
             else:
                 logger.info(f"Item {item_id} is not in stock")
+                stock_state.update_item(item_id, False)
 
         if len(available_items) == 0:
-            logger.info("No item is available yet")
+            logger.info("No new item is available yet")
             return
 
         mail_body += f"The following items are now available in ecuagenera.com:\n\n"
@@ -231,8 +319,9 @@ def run_web(user, headless):
                             new_wishlist += f"{old_wishlist_line}\n"
                     new_wishlist = new_wishlist.strip()
                     logger.debug(
-                        f'Attempting to update database entry {Config.WISHLIST} for user {email}:\n{new_wishlist}')
-                    set_user_config(user, Config.WISHLIST, new_wishlist)
+                        f'Attempting to update database entry {Config.WISHLIST} for user {user["email"]}:\n{new_wishlist}')
+                    user_updates.add(
+                        user, config={Config.WISHLIST: new_wishlist})
                     mail_body += "\nPlease proceed to pay by sending an email to the ecuagenera.com team."
                     mail_body += "\n\nHint: You should have received an email with the invoice from ecuagenera.com."
                 else:
@@ -246,10 +335,115 @@ def run_web(user, headless):
     # Step 2: Send Telegram message if necessary
     logger.info(mail_body)
     if inform_user:
-        inform_user_if_item_available(user, mail_body)
+        inform_user_if_item_available(
+            user, mail_body, list(available_items.keys()))
 
 
-if __name__ == "__main__":
+# Saves the cycle progress. The user updates (e.g. wishlist removals after a checkout) are written first,
+# as users which are marked as done are not run again - even if the process gets killed afterwards
+def save_checkpoint():
+    user_updates.flush()
+    checkpoint.save()
+
+
+def run_cycle(ec):
+    global telegram_chat_ids
+    # chat IDs are looked up again each cycle, as users might have linked their account meanwhile
+    telegram_chat_ids = None
+
+    cycle_start = time.time()
+
+    # get users with a valid account and non-empty wishlist (filtered and projected by the DB),
+    # paying users first (shuffled within each plan to ensure everyone gets their turn)
+    with metrics.timed('ecuagenera_db', {'op': 'get_crawler_users'}):
+        users = sort_users(get_crawler_users(ARGS.email))
+
+    # one browser per profile for all users of this cycle (launched on first use)
+    browser_pools = {'lean': BrowserPool(size=1, headless=headless, lean=True),
+                     'full': BrowserPool(size=1, headless=headless)}
+
+    # resume the last cycle if it got interrupted (items and users which are done are skipped)
+    if checkpoint.start(ARGS.method, config.get('checkpoint_max_age_minutes', 60) * 60):
+        logger.info(
+            f"Resuming interrupted cycle ({len(checkpoint.get_products())} items fetched already)")
+
+    try:
+        # fetch every distinct item once and fan the results out to all subscribers
+        products = {}
+        if ARGS.method == 'curl':
+            products = dict(checkpoint.get_products())
+            subscribers = plan_crawl(users)
+            # high priority items first, low priority items are only checked every few cycles
+            item_ids = [item_id for item_id in schedule_items(subscribers, stock_state, config.get(
+                'poll_intervals_minutes', POLL_INTERVALS)) if item_id not in products]
+            logger.info(
+                f"Fetching {len(item_ids)} of {len(subscribers)} distinct items for {len(users)} users")
+            products.update(fetch_products(ec, item_ids, ARGS.concurrency))
+            # persist the stock transitions right away, as they are part of the notification keys (outbox).
+            # This comes before the checkpoint, which skips refetching these products on resume
+            stock_state.save()
+            save_checkpoint()
+            metrics.set_gauge('ecuagenera_cycle_items', len(item_ids))
+
+        for i, user in enumerate(users, start=1):
+            if checkpoint.is_user_done(user['email']):
+                continue
+            logger.info(f"------------------------------")
+            logger.info(
+                f"Running for user {user['email']}")
+            logger.info(f"------------------------------")
+            # one failing user must not stop the others
+            try:
+                if ARGS.method == 'web':
+                    run_web(user, headless, browser_pools)
+                elif ARGS.method == 'curl':
+                    run_curl(user, products)
+                checkpoint.set_user_done(user['email'])
+            except Exception as e:
+                logger.error(f"Could not run for user {user['email']}: {e}")
+                logger.error(traceback.format_exc())
+                metrics.inc('ecuagenera_cycle_failures_total', {'kind': 'user'})
+                checkpoint.add_failure('user', user['email'], e)
+            if i % CHECKPOINT_EVERY == 0:
+                save_checkpoint()
+
+        failures = checkpoint.get_failures()
+        if len(failures) > 0:
+            logger.warning(
+                f"Cycle completed with {len(failures)} failures: {', '.join(f['key'] for f in failures)}")
+        user_updates.flush()
+        checkpoint.complete()
+
+        metrics.set_gauge('ecuagenera_cycle_users', len(users))
+        metrics.set_gauge('ecuagenera_cycle_last_success_timestamp_seconds', time.time())
+    except Exception:
+        metrics.inc('ecuagenera_cycle_errors_total')
+        raise
+    finally:
+        for browser_pool in browser_pools.values():
+            browser_pool.close()
+        # wait for the notifications of this cycle, as items are only marked as notified once delivered
+        notification_summary = dispatcher.drain()
+        if len(notification_summary) > 0:
+            logger.info(f"Telegram notifications: {notification_summary}")
+        # a DB failure must not prevent the local state and metrics from being saved
+        try:
+            user_updates.flush()
+        except Exception as e:
+            logger.error(f"Could not write user updates: {e}")
+            logger.error(traceback.format_exc())
+            metrics.inc('ecuagenera_cycle_failures_total', {'kind': 'db'})
+        item_index.save()
+        stock_state.save()
+        checkpoint.save()
+        product_cache.evict()
+        metrics.set_gauge('ecuagenera_cycle_duration_seconds', time.time() - cycle_start)
+        metrics.inc('ecuagenera_cycles_total')
+        metrics.write_textfile(config.get(
+            'metrics_file', get_data_file_path('ecuagenera_bot.prom')))
+
+
+def get_arg_parser() -> argparse.ArgumentParser:
     PARSER = argparse.ArgumentParser()
 
     PARSER.add_argument('--email', type=str,
@@ -258,15 +452,33 @@ if __name__ == "__main__":
                         help='Method to run (web;curl)', default='curl', required=False)
     PARSER.add_argument('--log_level', type=int,
                         help='The log level (10-50)', default=20, required=False)
+    PARSER.add_argument('--concurrency', type=int,
+                        help='Number of items to fetch in parallel (curl)', default=1, required=False)
+    PARSER.add_argument('--rate_limit', type=float,
+                        help='Max. requests per second against the shop (curl)', default=1.0, required=False)
+    PARSER.add_argument('--daemon',
+                        help='Keep running and start a new cycle every --interval minutes', required=False, action='store_true')
+    PARSER.add_argument('--interval', type=float,
+                        help='Minutes between two cycles (daemon)', default=30, required=False)
+    PARSER.add_argument('--jitter', type=float,
+                        help='Max. random minutes added to the interval (daemon)', default=2, required=False)
+    PARSER.add_argument('--metrics_port', type=int,
+                        help='Port to serve Prometheus metrics on (daemon)', required=False)
     PARSER.add_argument('--headless',
                         help='Headless mode', required=False, action='store_true')
-    ARGS = PARSER.parse_args()
+    return PARSER
+
+
+# Sets up the state shared by all cycles (module globals used by the run_* functions)
+def setup(args, bot_config: dict):
+    global ARGS, config, logger, headless, item_index, bot, outbox, dispatcher, checkpoint, product_cache, telegram_chat_ids, stock_state, renotify_interval, user_updates
+
+    ARGS = args
+    config = bot_config
 
     logger = Logger.logger
     logger.setLevel(ARGS.log_level)
 
-    config = reload_config_yml()
-
     # set headless to default for Raspberry Pi or if passed via commandline
     headless = False
     if ARGS.headless != None:
@@ -274,37 +486,85 @@ if __name__ == "__main__":
     if "arm" in platform.machine():
         headless = True
 
-    # get user list from DB
-    all_users = get_db_users()
-
-    # filter users who do not have valid account anymore
-    users = []
-    for user in all_users:
-        # also filter email in case ARGS is set
-        if ARGS.email is not None:
-            if user['email'] == ARGS.email:
-                users.append(user)
-                break
-            else:
-                continue
-        users.append(user)
+    # remembers which URL style resolves each item across runs
+    item_index = ItemIndex(config.get(
+        'item_index_file', get_data_file_path('item_index.json')))
+
+    # item names, canonical URLs and HTTP validators of the product pages (also read by the Telegram bot)
+    product_cache = ProductCache(config.get('product_cache_file', get_data_file_path('product_cache.sqlite')),
+                                 ttl=config.get('product_cache_ttl_days', 30) * 24 * 3600,
+                                 max_entries=config.get('product_cache_max_entries', 10000))
+
+    # last seen stock state per item, so that users are only notified on changes
+    # (or again after `renotify_interval_hours`)
+    stock_state = StockState(config.get(
+        'stock_state_file', get_data_file_path('stock_state.json')))
+    renotify_interval = config.get('renotify_interval_hours', 24) * 3600
+
+    # progress of the current cycle, so that an interrupted cycle resumes where it stopped
+    # (not persisted for --email runs, which would resume and then clear the full cycle's progress)
+    checkpoint = CrawlCheckpoint(config.get(
+        'checkpoint_file', get_data_file_path('crawl_checkpoint.json')), persistent=ARGS.email is None)
+
+    # collects all user changes of a cycle, which are written at once in the end
+    user_updates = UserUpdateBatch()
+
+    # one bot for all notifications, chat IDs are looked up once per cycle
+    # (one connection per dispatcher worker, so that parallel sends keep their connection alive)
+    telegram_workers = config.get('telegram_workers', 4)
+    bot = Bot(config['telegram_bot_token'],
+              request=Request(con_pool_size=telegram_workers))
+    telegram_chat_ids = None
+
+    # every notification is persisted before sending, notifications of a crashed run are sent first
+    outbox = Outbox(config.get(
+        'outbox_file', get_data_file_path('outbox.sqlite')))
+    outbox.prune(config.get('outbox_retention_days', 30) * 24 * 3600)
+
+    # sends the notifications in the background while crawling continues (rate limited, with retries).
+    # Started last, as the callbacks of replayed notifications use the state above (e.g. stock_state)
+    dispatcher = NotificationDispatcher(bot, workers=telegram_workers,
+                                        rate=config.get('telegram_rate_limit', 25), outbox=outbox, logger=logger)
+    dispatcher.start()
+    replay_outbox()
 
-    # shuffle order (to ensure everyone gets their turn)
-    random.shuffle(users)
+
+if __name__ == "__main__":
+    ARGS = get_arg_parser().parse_args()
+    setup(ARGS, reload_config_yml())
 
     try:
-        for user in users:
-            logger.info(f"------------------------------")
-            email = user['email']
-            logger.info(
-                f"Running for user {email}")
-            logger.info(f"------------------------------")
-            if ARGS.method == 'web':
-                run_web(user, headless)
-            elif ARGS.method == 'curl':
-                run_curl(user)
+        # the flaresolverr sessions are kept open across cycles in daemon mode
+        rate_limiter = RateLimiter(rate=ARGS.rate_limit, burst=ARGS.concurrency)
+        # fail fast if flaresolverr is down or cloudflare blocks us (probing again with growing pauses)
+        circuit_breaker = CircuitBreaker('fetch', failure_threshold=config.get('circuit_failure_threshold', 5),
+                                         reset_timeout=config.get('circuit_reset_timeout_seconds', 30))
+        with EcuageneraCurl(headless=headless, item_index=item_index, rate_limiter=rate_limiter,
+                            sessions=ARGS.concurrency if ARGS.method == 'curl' else 0,
+                            circuit_breaker=circuit_breaker, product_cache=product_cache) as ec:
+            if ARGS.daemon and ARGS.metrics_port is not None:
+                metrics.start_http_server(ARGS.metrics_port)
+            if not ARGS.daemon:
+                run_cycle(ec)
+            while ARGS.daemon:
+                cycle_start = time.monotonic()
+                try:
+                    run_cycle(ec)
+                except Exception as e:
+                    # keep the daemon alive, the next cycle might succeed
+                    logger.error(e)
+                    logger.error(traceback.format_exc())
+                sleep_time = max(0, ARGS.interval * 60 - (time.monotonic() - cycle_start)) + \
+                    random.uniform(0, ARGS.jitter * 60)
+                logger.info(f"Next cycle in {sleep_time:.0f}s")
+                time.sleep(sleep_time)
 
     except Exception as e:
         logger.error(e)
         logger.error(traceback.format_exc())
         sys.exit(1)
+    finally:
+        dispatcher.close()
+        outbox.close()
+        product_cache.close()
+        close_db_client()
@@ -1,9 +1,10 @@
 import json
+import queue
 import time
+from urllib.parse import urlparse
 
 import requests
-from lxml import etree
-from lxml.etree import ParserError
+from requests.adapters import HTTPAdapter
 from selenium import webdriver
 from selenium.common.exceptions import NoSuchElementException
 from selenium.webdriver.chrome.options import Options
@@ -11,7 +12,12 @@ from selenium.webdriver.common.by import By
 from selenium.webdriver.support import expected_conditions as EC
 from selenium.webdriver.support.ui import Select, WebDriverWait
 
+from ecua_utils import metrics
+from ecua_utils.item_index import (URL_STYLE_INVALID, URL_STYLE_OBJECT_ID,
+                                   URL_STYLES)
 from ecua_utils.logger import Logger
+from ecua_utils.product_parser import (NOT_AVAILABLE_MARKER, is_product_page,
+                                       parse_product_page)
 
 logger = Logger.logger
 
@@ -20,62 +26,305 @@ class EcuageneraCurl:
     product_url_object_path = "https://www.ecuagenera.com/epages/ecuagenera.sf/en_US/?ObjectPath=/Shops/ecuagenera/Products/"
     product_url_object_id = "https://www.ecuagenera.com/epages/ecuagenera.sf/en_US/?ObjectID="
     flaresolverr_url = "http://localhost:8191/v1"
-    last_response = None
+    flaresolverr_headers = {'content-type': 'application/json',
+                            'Accept-Charset': 'UTF-8'}
+    # (not `challenge-platform`, as cloudflare injects such scripts into regular pages as well)
+    challenge_markers = ["_cf_chl_opt", "<title>Just a moment...</title>"]
+    direct_timeout = 30
+    # (connect, read) timeouts - the read timeout has to be longer than flaresolverr's maxTimeout
+    flaresolverr_timeout = (5, 75)
+    last_html = None
+    last_url_style = None
 
-    def __init__(self, username=None, password=None, headless=False):
-        pass
+    def __init__(self, username=None, password=None, headless=False, item_index=None, rate_limiter=None, sessions=0, direct=True,
+                 circuit_breaker=None, product_cache=None):
+        # product snapshots fetched during this run (item_id -> dict)
+        self.products = {}
+        self.item_index = item_index
+        self.rate_limiter = rate_limiter
+        # stops fetching for a while after consecutive failures (flaresolverr down, cloudflare blocking)
+        self.circuit_breaker = circuit_breaker
+        # names and HTTP validators of the product pages across runs (pages are revalidated conditionally)
+        self.product_cache = product_cache
+        # pool of flaresolverr sessions (browser instances), which are used round-robin
+        self.session_count = sessions
+        self.sessions = queue.Queue()
+        # plain HTTP session (keep-alive, gzip) re-using cookies / user agent of a flaresolverr solution.
+        # It is only used once a solution has been harvested and until cloudflare challenges it again
+        self.direct = direct
+        self.direct_ready = False
+        self.http = requests.Session()
+        self.http.mount("https://", HTTPAdapter(
+            pool_connections=1, pool_maxsize=max(sessions, 1)))
 
     def __enter__(self):
+        for _ in range(self.session_count):
+            self.sessions.put(self.create_session())
         return self
 
     def __exit__(self, exc_type, exc_value, traceback):
-        pass
+        while not self.sessions.empty():
+            session = self.sessions.get()
+            if session is not None:
+                self.destroy_session(session)
+        self.http.close()
 
-    def open_item_page(self, item_id: str) -> bool:
+    def flaresolverr_cmd(self, payload: dict) -> requests.Response:
+        return requests.post(self.flaresolverr_url,
+                             data=json.dumps(payload), headers=self.flaresolverr_headers, timeout=self.flaresolverr_timeout)
+
+    # Returns the ID of a new flaresolverr session or None if it could not be created
+    def create_session(self):
+        try:
+            r = self.flaresolverr_cmd({"cmd": "sessions.create"})
+            session = r.json()["session"]
+            logger.debug(f"Created flaresolverr session {session}")
+            return session
+        except (requests.RequestException, ValueError, KeyError) as e:
+            logger.warning(f"Could not create flaresolverr session: {e}")
+            return None
+
+    def destroy_session(self, session: str):
+        try:
+            self.flaresolverr_cmd(
+                {"cmd": "sessions.destroy", "session": session})
+            logger.debug(f"Destroyed flaresolverr session {session}")
+        except requests.RequestException as e:
+            logger.warning(
+                f"Could not destroy flaresolverr session {session}: {e}")
+
+    # Returns True if the page is still a Cloudflare challenge instead of the actual page
+    def is_challenge(self, text: str) -> bool:
+        return any(marker in text for marker in self.challenge_markers)
+
+    # Takes over cookies (e.g. `cf_clearance`) and user agent of a flaresolverr solution for direct requests
+    def harvest_solution(self, solution: dict):
+        if not self.direct or len(solution.get('cookies', [])) == 0:
+            return
+        for cookie in solution['cookies']:
+            self.http.cookies.set(
+                cookie['name'], cookie['value'], domain=cookie.get('domain', ''), path=cookie.get('path', '/'))
+        self.http.headers['User-Agent'] = solution['userAgent']
+        if not self.direct_ready:
+            logger.debug("Harvested flaresolverr solution - using direct requests")
+        self.direct_ready = True
+
+    # Returns (status code, html, validators) of a page requested directly, or (None, None, None) if cloudflare
+    # challenged it. With `validators` (`etag` / `last_modified` of a previous response) the page is only sent
+    # if it was modified, otherwise the status code is 304 and html None
+    def get_page_direct(self, url: str, validators: dict = None) -> tuple:
+        headers = {}
+        if validators is not None:
+            if validators.get('etag') is not None:
+                headers['If-None-Match'] = validators['etag']
+            if validators.get('last_modified') is not None:
+                headers['If-Modified-Since'] = validators['last_modified']
+        try:
+            r = self.http.get(url, headers=headers, timeout=self.direct_timeout)
+        except requests.RequestException as e:
+            logger.debug(f"Direct request failed - falling back to flaresolverr: {e}")
+            return None, None, None
+        if r.status_code == 304:
+            return r.status_code, None, validators
+        if r.status_code in [403, 503] or self.is_challenge(r.text):
+            logger.debug("Direct request got challenged - falling back to flaresolverr")
+            metrics.inc('ecuagenera_challenges_total', {'method': 'direct'})
+            self.direct_ready = False
+            return None, None, None
+        return r.status_code, r.text, {'etag': r.headers.get('ETag'), 'last_modified': r.headers.get('Last-Modified')}
+
+    # Returns (status code, html, session) of a page requested via flaresolverr. A session which returns
+    # a challenge or an error (e.g. "session does not exist" after flaresolverr restarted) is recreated and
+    # the request retried once, hence the (possibly new) session is returned as well
+    def get_page_flaresolverr(self, url: str, session) -> tuple:
         payload = {
             "cmd": "request.get",
             "userAgent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleW...",
             "maxTimeout": 60000,
+            "url": url,
             # "headers": {
             #     "X-Test": "Testing 123..."
             # }
         }
-        headers = {'content-type': 'application/json',
-                   'Accept-Charset': 'UTF-8'}
-
-        # try object path first
-        payload["url"] = f"{self.product_url_object_path}{item_id}"
-        r = requests.post(self.flaresolverr_url,
-                          data=json.dumps(payload), headers=headers)
-        if r.status_code == 200 and not "The page requested is not available." in r.text:
-            self.last_response = r
-            return True
-
-        payload["url"] = f"{self.product_url_object_id}{item_id}"
-        r = requests.post(self.flaresolverr_url,
-                          data=json.dumps(payload), headers=headers)
-        if r.status_code == 200 and not "The page requested is not available." in r.text:
-            self.last_response = r
-            return True
+        if session is not None:
+            payload["session"] = session
+        r = self.flaresolverr_cmd(payload)
+        if session is not None and (r.status_code != 200 or self.is_challenge(r.text)):
+            if r.status_code != 200:
+                logger.info(
+                    f"Flaresolverr session {session} returned status {r.status_code} - recreating it")
+                metrics.inc('ecuagenera_session_errors_total')
+            else:
+                logger.info(
+                    f"Flaresolverr session {session} returned a challenge - recreating it")
+                metrics.inc('ecuagenera_challenges_total', {'method': 'flaresolverr'})
+            self.destroy_session(session)
+            session = self.create_session()
+            if session is None:
+                payload.pop("session")
+            else:
+                payload["session"] = session
+            r = self.flaresolverr_cmd(payload)
+        if r.status_code != 200 or self.is_challenge(r.text):
+            return r.status_code, None, session
+        try:
+            solution = r.json()['solution']
+        except (ValueError, KeyError) as e:
+            logger.error(f"Unexpected flaresolverr response: {e}")
+            return None, None, session
+        self.harvest_solution(solution)
+        return r.status_code, solution['response'], session
+
+    def get_item_url(self, item_id: str, url_style: str) -> str:
+        if url_style == URL_STYLE_OBJECT_ID:
+            return f"{self.product_url_object_id}{item_id}"
+        return f"{self.product_url_object_path}{item_id}"
+
+    def open_item_page(self, item_id: str) -> bool:
+        html, url_style, _ = self.request_item_page(item_id)
+        if html is None:
+            return False
+        self.last_html = html
+        self.last_url_style = url_style
+        return True
+
+    # Returns the html, URL style and HTTP validators of the item page, or (None, None, None) if it can't be opened.
+    # If the shop says the item is not available (or it is known to be invalid), the URL style is URL_STYLE_INVALID.
+    # If the `cached` product cache entry is given and the page was not modified since, html is None.
+    # Does not touch any shared state, so that it can be called from multiple threads.
+    # Raises CircuitOpenError if fetching is suspended after consecutive failures
+    def request_item_page(self, item_id: str, cached: dict = None) -> tuple:
+        # try the URL style which worked last time first (object path by default)
+        url_styles = URL_STYLES
+        if self.item_index is not None:
+            url_styles = self.item_index.get_url_styles(item_id)
+            if len(url_styles) == 0:
+                logger.debug(
+                    f'item {item_id} is known to be invalid - skipping')
+                return None, URL_STYLE_INVALID, None
+
+        # borrow a session from the pool (if any), so that cloudflare is only solved once per session.
+        # Slots without a session (None) are re-created lazily and fall back to stateless requests
+        session = None
+        if self.session_count > 0:
+            session = self.sessions.get()
+            if session is None:
+                session = self.create_session()
+
+        try:
+            not_found = True
+            for url_style in url_styles:
+                url = self.get_item_url(item_id, url_style)
+                if self.circuit_breaker is not None:
+                    self.circuit_breaker.check()
+                if self.rate_limiter is not None:
+                    self.rate_limiter.acquire(urlparse(url).hostname)
+
+                # plain HTTP is milliseconds instead of seconds, flaresolverr only if challenged.
+                # Pages fetched before are requested conditionally (only sent if modified)
+                validators = None
+                if cached is not None and cached['url_style'] == url_style:
+                    validators = cached
+                status_code, html = None, None
+                method = 'direct'
+                try:
+                    if self.direct_ready:
+                        with metrics.timed('ecuagenera_fetch', {'method': 'direct'}):
+                            status_code, html, validators = self.get_page_direct(
+                                url, validators)
+                    if html is None and status_code != 304:
+                        validators = None
+                        method = 'flaresolverr'
+                        with metrics.timed('ecuagenera_fetch', {'method': 'flaresolverr'}):
+                            status_code, html, session = self.get_page_flaresolverr(
+                                url, session)
+                except Exception:
+                    # (counted as ecuagenera_fetch_errors_total by metrics.timed)
+                    if self.circuit_breaker is not None:
+                        self.circuit_breaker.record_failure()
+                    raise
+
+                # a 200 page which is neither a product nor "not available" page (maintenance, sign-in,
+                # error page) is a failed fetch - it must never be taken as product (e.g. in stock)
+                not_available = html is not None and NOT_AVAILABLE_MARKER in html
+                is_product = status_code == 200 and html is not None and is_product_page(html)
+                if html is not None and not not_available and not is_product:
+                    logger.warning(
+                        f'item {item_id} returned no product page (status {status_code})')
+                    html = None
+
+                # (a "not available" page is a regular answer of the shop)
+                if self.circuit_breaker is not None:
+                    if html is not None or status_code == 304:
+                        self.circuit_breaker.record_success()
+                    else:
+                        self.circuit_breaker.record_failure()
+
+                if status_code == 304:
+                    return None, url_style, validators
+                if not_available:
+                    continue
+                if is_product:
+                    if self.item_index is not None:
+                        self.item_index.set_url_style(item_id, url_style)
+                    return html, url_style, validators
+                metrics.inc('ecuagenera_fetch_bad_responses_total', {'method': method})
+                not_found = False
+        finally:
+            if self.session_count > 0:
+                self.sessions.put(session)
 
         logger.warning(
             f'item {item_id} is not available - Are you sure the ID is correct?')
-        return False
+        # only remember IDs as invalid if the shop said so (and not e.g. flaresolverr)
+        if not_found:
+            if self.item_index is not None:
+                self.item_index.set_url_style(item_id, URL_STYLE_INVALID)
+            return None, URL_STYLE_INVALID, None
+        return None, None, None
+
+    # Returns a snapshot (name, available, price, quantities, url_style) of the product page, which is
+    # fetched only once per run and served from the cache afterwards. `not_found` is True if the shop
+    # says that the item is not available (as opposed to a failed fetch)
+    def fetch_product(self, item_id: str) -> dict:
+        if item_id in self.products:
+            return self.products[item_id]
+
+        cached = None
+        if self.product_cache is not None:
+            cached = self.product_cache.get(item_id)
+
+        product = {'id': item_id, 'valid': False, 'name': "invalid item ID",
+                   'available': False, 'price': None, 'quantities': [], 'url_style': None, 'not_found': False}
+        html, url_style, validators = self.request_item_page(item_id, cached)
+        if url_style == URL_STYLE_INVALID:
+            product['not_found'] = True
+        elif html is not None:
+            product['url_style'] = url_style
+            product.update(parse_product_page(html))
+            if product['name'] is None:
+                logger.warning(f'Could not find name of item {item_id}')
+                product['name'] = cached['name'] if cached is not None and cached['name'] else item_id
+            if self.product_cache is not None:
+                self.product_cache.put(item_id, name=product['name'], url=self.get_item_url(item_id, url_style),
+                                       url_style=url_style, etag=validators['etag'] if validators else None,
+                                       last_modified=validators['last_modified'] if validators else None,
+                                       available=product['available'], price=product['price'],
+                                       quantities=product['quantities'])
+        elif url_style is not None:
+            # not modified since the last fetch - the cached stock is still accurate
+            metrics.inc('ecuagenera_fetch_not_modified_total')
+            product['valid'] = True
+            product['url_style'] = url_style
+            for field in ['name', 'available', 'price', 'quantities']:
+                product[field] = cached[field]
+            self.product_cache.put(item_id)
+
+        self.products[item_id] = product
+        return product
 
     def is_item_available(self, item_id: str) -> bool:
-        if not self.open_item_page(item_id):
-            return False
-        return "Out of stock" not in self.last_response.text
+        return self.fetch_product(item_id)['available']
 
     def get_item_name(self, item_id: str) -> str:
-        if not self.open_item_page(item_id):
-            return "invalid item ID"
-        try:
-            parser = etree.HTMLParser()
-            response_json = json.loads(self.last_response.content)
-            html_dom = etree.HTML(
-                response_json['solution']["response"], parser)
-            name = html_dom.xpath("//*[@itemprop='name']/text()")
-        except ParserError as e:
-            logger.error(e)
-        return name[0]
+        return self.fetch_product(item_id)['name']
@@ -1,37 +1,143 @@
+import queue
+import threading
+
 from selenium import webdriver
-from selenium.common.exceptions import NoSuchElementException
+from selenium.common.exceptions import (NoSuchElementException,
+                                        WebDriverException)
 from selenium.webdriver.chrome.options import Options
 from selenium.webdriver.common.by import By
 from selenium.webdriver.support import expected_conditions as EC
 from selenium.webdriver.support.ui import Select, WebDriverWait
+from ecua_utils.item_index import (URL_STYLE_INVALID, URL_STYLE_OBJECT_ID,
+                                   URL_STYLES)
 from ecua_utils.logger import Logger
 import time
 
 logger = Logger.logger
 
+
+# third-party requests (analytics, ads, social, fonts) and images, which are not needed to read the stock
+blocked_url_patterns = [
+    "*google-analytics.com*", "*googletagmanager.com*", "*doubleclick.net*",
+    "*facebook.net*", "*facebook.com*", "*hotjar.com*", "*trustedshops.com*",
+    "*fonts.googleapis.com*", "*fonts.gstatic.com*", "*youtube.com*",
+    "*.jpg*", "*.jpeg*", "*.png*", "*.gif*", "*.webp*", "*.svg*", "*.woff*", "*.ttf*",
+]
+
+
+# Returns a new Chrome instance. The lean profile (no images, no third-party requests, no waiting for
+# subresources) is meant for stock checks, the full profile for login / checkout flows
+def create_driver(headless=False, lean=False) -> webdriver.Chrome:
+    chrome_options = Options()
+    if headless:
+        chrome_options.add_argument("--headless")
+    chrome_options.add_argument("--no-sandbox")  # for sudo linux usage
+    chrome_options.add_argument('--no-proxy-server')
+    if lean:
+        chrome_options.add_experimental_option(
+            "prefs", {"profile.managed_default_content_settings.images": 2})
+        chrome_options.add_argument("--blink-settings=imagesEnabled=false")
+        # return from driver.get() once the DOM is ready instead of after all subresources are loaded
+        chrome_options.set_capability("pageLoadStrategy", "eager")
+    driver = webdriver.Chrome(options=chrome_options)
+    driver.set_window_size(1600, 768)
+    if lean:
+        try:
+            driver.execute_cdp_cmd("Network.enable", {})
+            driver.execute_cdp_cmd("Network.setBlockedURLs", {
+                                   "urls": blocked_url_patterns})
+        except WebDriverException as e:
+            logger.warning(f"Could not block third-party requests: {e}")
+    return driver
+
+
+class BrowserPool:
+    """Pool of up to `size` Chrome instances, which are launched on first use and shared by
+    all users of a run. Each user gets a clean browser (no cookies / storage of the previous user)."""
+
+    def __init__(self, size=1, headless=False, lean=False):
+        self.size = size
+        self.headless = headless
+        self.lean = lean
+        self.lock = threading.Lock()
+        self.drivers = []
+        self.idle = queue.Queue()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def acquire(self) -> webdriver.Chrome:
+        with self.lock:
+            if self.idle.empty() and len(self.drivers) < self.size:
+                driver = create_driver(self.headless, self.lean)
+                self.drivers.append(driver)
+                return driver
+        return self.idle.get()
+
+    # Isolates the next user from the previous one and returns the browser to the pool
+    def release(self, driver: webdriver.Chrome):
+        try:
+            driver.delete_all_cookies()
+            driver.execute_script(
+                "window.localStorage.clear(); window.sessionStorage.clear();")
+        except WebDriverException as e:
+            logger.debug(f"Could not clear browser storage: {e}")
+        try:
+            driver.get("about:blank")
+        except WebDriverException as e:
+            # e.g. crashed browser - replace it on next use (quit first, so that no chrome processes are left)
+            logger.warning(f"Dropping broken browser from pool: {e}")
+            try:
+                driver.quit()
+            except WebDriverException as e:
+                logger.warning(f"Could not quit broken browser: {e}")
+            with self.lock:
+                self.drivers.remove(driver)
+            return
+        self.idle.put(driver)
+
+    def close(self):
+        with self.lock:
+            for driver in self.drivers:
+                try:
+                    driver.quit()
+                except WebDriverException as e:
+                    logger.warning(f"Could not quit browser: {e}")
+            self.drivers = []
+            self.idle = queue.Queue()
+
+
 class EcuageneraWebsite:
     url = "https://www.ecuagenera.com/epages/ecuagenera.sf/en_US/?ObjectPath=/Shops/ecuagenera&ViewAction=ViewMyAccount&LastViewAction=ViewMyAccount&HideNotice=1"
     product_url_object_path = "https://www.ecuagenera.com/epages/ecuagenera.sf/en_US/?ObjectPath=/Shops/ecuagenera/Products/"
     product_url_object_id = "https://www.ecuagenera.com/epages/ecuagenera.sf/en_US/?ObjectID="
 
-    def __init__(self, username=None, password=None, headless=False):
+    def __init__(self, username=None, password=None, headless=False, item_index=None, pool=None, lean=False, product_cache=None):
         self.username = username
         self.password = password
+        self.item_index = item_index
+        # item names are taken from the cache, so that the item page does not have to be opened again
+        self.product_cache = product_cache
 
-        chrome_options = Options()
-        if headless:
-            chrome_options.add_argument("--headless")
-        chrome_options.add_argument("--no-sandbox")  # for sudo linux usage
-        chrome_options.add_argument('--no-proxy-server')
-        self.driver = webdriver.Chrome(options=chrome_options)
-        self.driver.set_window_size(1600, 768)
+        # borrow the browser from the pool (if any) instead of launching a new one
+        self.pool = pool
+        if pool is not None:
+            self.driver = pool.acquire()
+        else:
+            self.driver = create_driver(headless, lean)
 
     def __enter__(self):
         return self
 
     def __exit__(self, exc_type, exc_value, traceback):
         # time.sleep(5)
-        self.driver.close()
+        if self.pool is not None:
+            self.pool.release(self.driver)
+        else:
+            self.driver.close()
 
     def open_website(self):
         self.driver.get(self.url)
@@ -49,15 +155,31 @@ class EcuageneraWebsite:
         self.driver.find_element_by_name('Save').click()
 
     def open_item_page(self, item_id: str) -> bool:
-        # try object path first
-        self.driver.get(f"{self.product_url_object_path}{item_id}")
-        if len(self.driver.find_elements_by_class_name('ProductDetails')) > 0:
-            return True
+        # try the URL style which worked last time first (object path by default)
+        url_styles = URL_STYLES
+        if self.item_index is not None:
+            url_styles = self.item_index.get_url_styles(item_id)
+            if len(url_styles) == 0:
+                logger.debug(
+                    f'item {item_id} is known to be invalid - skipping')
+                return False
 
-        self.driver.get(f"{self.product_url_object_id}{item_id}")
-        if len(self.driver.find_elements_by_class_name('ProductDetails')) > 0:
-            return True
+        not_found = True
+        for url_style in url_styles:
+            if url_style == URL_STYLE_OBJECT_ID:
+                self.driver.get(f"{self.product_url_object_id}{item_id}")
+            else:
+                self.driver.get(f"{self.product_url_object_path}{item_id}")
+            if len(self.driver.find_elements_by_class_name('ProductDetails')) > 0:
+                if self.item_index is not None:
+                    self.item_index.set_url_style(item_id, url_style)
+                return True
+            if not "The page requested is not available." in self.driver.page_source:
+                not_found = False
 
+        # only remember IDs as invalid if the shop said so (and not e.g. a timeout)
+        if self.item_index is not None and not_found:
+            self.item_index.set_url_style(item_id, URL_STYLE_INVALID)
         logger.warning(
             f'item {item_id} is not available - Are you sure the ID is correct?')
         return False
@@ -75,9 +197,17 @@ class EcuageneraWebsite:
         self.driver.find_element_by_name('AddToBasket').click()
 
     def get_item_name(self, item_id: str) -> str:
+        if self.product_cache is not None:
+            cached = self.product_cache.get(item_id)
+            if cached is not None and cached['name']:
+                return cached['name']
         if not self.open_item_page(item_id):
             return "invalid item ID"
-        return self.driver.find_element_by_xpath("//*[@itemprop='name']").text
+        name = self.driver.find_element_by_xpath("//*[@itemprop='name']").text
+        if self.product_cache is not None:
+            self.product_cache.put(
+                item_id, name=name, url=self.driver.current_url)
+        return name
 
     def clear_basket(self):
         # click on basket
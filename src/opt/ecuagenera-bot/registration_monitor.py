@@ -14,7 +14,8 @@ from datetime import datetime
 from dateutil.relativedelta import relativedelta
 
 from ecua_utils.util import reload_config_yml
-from ecua_utils.db_utils import get_db_col, get_db_users_field
+from ecua_utils.db_utils import (close_db_client, get_db_col,
+                                 get_user_by_email)
 
 # API documentation in https://developer.atlassian.com/cloud/trello/rest/
 base_url = "https://api.trello.com/1"
@@ -66,7 +67,7 @@ def register_user(card):
     )
     print(f"Trying to add new user {new_user} to db")
     users_col = get_db_col()
-    if email in get_db_users_field("email"):
+    if get_user_by_email(new_user['email']) is not None:
         print("User exists already in db - aborting")
         return False
     result = users_col.insert_one(new_user)
@@ -154,3 +155,5 @@ if __name__ == '__main__':
             move_card(card, done_idList)
         else:
             move_card(card, problem_idList)
+
+    close_db_client()
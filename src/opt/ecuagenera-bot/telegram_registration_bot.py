@@ -13,6 +13,7 @@ import json
 import os
 import platform
 import re
+import sqlite3
 import traceback
 from datetime import datetime
 from typing import Dict
@@ -30,11 +31,15 @@ from telegram.ext import (CallbackContext, CallbackQueryHandler,
                           MessageHandler, PicklePersistence,
                           PreCheckoutQueryHandler, ShippingQueryHandler,
                           Updater)
+from telegram.utils.helpers import escape_markdown
 
-from ecua_utils.db_utils import (Config, get_db_users, get_db_users_field,
-                                 set_user_config, set_user_expiry_date)
+from ecua_utils.db_utils import (Config, close_db_client, ensure_db_indexes,
+                                 get_user_by_email, set_user_config,
+                                 set_user_telegram_chat_id, update_user)
+from ecua_utils.crawl_utils import parse_wishlist
 from ecua_utils.logger import TelegramLogger
-from ecua_utils.util import reload_config_yml
+from ecua_utils.product_cache import ProductCache
+from ecua_utils.util import get_data_file_path, reload_config_yml
 
 EMAIL = range(1)
 SELECTING_ACTION, CONFIGURE_WISHLIST, CONFIGURE_AUTO_CHECKOUT, RETURN_WISHLIST, RETURN_AUTO_CHECKOUT = map(
@@ -42,14 +47,23 @@ SELECTING_ACTION, CONFIGURE_WISHLIST, CONFIGURE_AUTO_CHECKOUT, RETURN_WISHLIST,
 AUTO_CHECKOUT_ON, AUTO_CHECKOUT_OFF = map(chr, range(6, 8))
 
 
+# Returns a dict of item_id -> name of the items which are in the crawler's product cache
+def get_item_names(item_ids: list) -> dict:
+    try:
+        with ProductCache(config.get('product_cache_file', get_data_file_path('product_cache.sqlite'))) as product_cache:
+            return product_cache.get_names(item_ids)
+    except sqlite3.Error as e:
+        logger.warning(f"Could not read product cache: {e}")
+        return {}
+
+
 def get_user_data(update: Update, context: CallbackContext) -> tuple:
     key = update.effective_chat.id
     email = context.user_data[key]
-    registered_users: list = get_db_users()
-    registered_emails: list = get_db_users_field('email')
-    index = registered_emails.index(email)
-    user = registered_users[index]
-    return user, email, registered_users
+    user = get_user_by_email(email)
+    if user is None:
+        raise ValueError(f"Linked email {email} is not registered")
+    return user, email
 
 
 def link(update: Update, context: CallbackContext) -> int:
@@ -87,6 +101,7 @@ def unlink_command(update: Update, context: CallbackContext) -> int:
         )
         logger.info(f"Deleted entry for user {email}/{key}")
         context.user_data.pop(key)
+        set_user_telegram_chat_id(email, None)
     else:
         reply_text += (
             "You can't unlink your account, if you haven't linked it yet :)"
@@ -110,9 +125,8 @@ def email(update: Update, context: CallbackContext) -> int:
         return EMAIL
 
     # verify if registered
-    registered_users: list = get_db_users()
-    registered_emails: list = get_db_users_field('email')
-    if not email in registered_emails:
+    registered_user = get_user_by_email(email)
+    if registered_user is None:
         logger.info(
             f"Cannot find entered email ({email}) in registered user list")
         update.message.reply_text(
@@ -122,13 +136,13 @@ def email(update: Update, context: CallbackContext) -> int:
         )
         return EMAIL
 
-    index = registered_emails.index(email)
     logger.info(
         f"Linked chat ID ({user.username}/{key}) with email '{email}'")
 
-    # Store value
+    # Store value (chat ID also in DB, so that the crawler can notify without the persistence file)
     context.user_data[key] = email
-    actual_user = registered_users[index]["real_name"]
+    set_user_telegram_chat_id(email, key)
+    actual_user = registered_user["real_name"]
 
     update.message.reply_text(
         f'Thank you, {actual_user}! Please /configure your wish-list now, to get notifications :)')
@@ -166,7 +180,7 @@ def configure(update: Update, context: CallbackContext) -> int:
 
 
 def configure_wishlist(update: Update, context: CallbackContext) -> str:
-    user, _, _ = get_user_data(update, context)
+    user, _ = get_user_data(update, context)
 
     wishlist = ""
     if 'config' in user.keys():
@@ -196,9 +210,16 @@ def configure_wishlist(update: Update, context: CallbackContext) -> str:
         update.effective_message.reply_text(
             '*Current wish\\-list*:', parse_mode='MarkdownV2')
         wishlist = wishlist.strip()
+        # show the item names known from the crawler (if any)
+        item_names = get_item_names(
+            [item_id for item_id, _ in parse_wishlist(wishlist)])
         text = ''
         for line in wishlist.splitlines():
-            text += f'`{line}`\n'
+            item_id = line.split(';')[0].strip()
+            if item_id in item_names:
+                text += f'`{line}` ({escape_markdown(item_names[item_id])})\n'
+            else:
+                text += f'`{line}`\n'
         update.effective_message.reply_text(
             text, parse_mode='Markdown')
     else:
@@ -215,7 +236,7 @@ def configure_wishlist(update: Update, context: CallbackContext) -> str:
 
 
 def configure_auto_checkout(update: Update, context: CallbackContext) -> str:
-    user, _, _ = get_user_data(update, context)
+    user, _ = get_user_data(update, context)
 
     auto_checkout = False
     user_plan = ''
@@ -264,7 +285,7 @@ def configure_auto_checkout(update: Update, context: CallbackContext) -> str:
 
 
 def update_db_auto_checkout(update: Update, context: CallbackContext) -> int:
-    user, email, _ = get_user_data(update, context)
+    user, email = get_user_data(update, context)
 
     if update.callback_query.data == str(AUTO_CHECKOUT_ON):
         logger.info(
@@ -289,7 +310,7 @@ def update_db_auto_checkout(update: Update, context: CallbackContext) -> int:
 
 def update_db_wishlist(update: Update, context: CallbackContext) -> int:
     user_input = update.message.text.replace(' ', '')
-    user, email, _ = get_user_data(update, context)
+    user, email = get_user_data(update, context)
 
     user_plan = "free"
     if 'config' in user.keys():
@@ -405,7 +426,7 @@ def user_info_command(update: Update, context: CallbackContext) -> None:
     reply_text = ""
     key = update._effective_chat.id
     if key in context.user_data:
-        user, email, _ = get_user_data(update, context)
+        user, email = get_user_data(update, context)
         try:
             actual_user_name = user['real_name']
             actual_user_expiry_date = 'na'
@@ -502,7 +523,7 @@ def start_upgrade_callback(update: Update, context: CallbackContext) -> None:
         update.message.reply_text(
             "You must first tell me who you are before you can upgrade your account. Do that via /link.")
         return ConversationHandler.END
-    user, email, _ = get_user_data(update, context)
+    user, email = get_user_data(update, context)
     user_plan = ''
     if 'config' in user.keys():
         if Config.PLAN in user['config'].keys():
@@ -564,18 +585,17 @@ def precheckout_callback(update: Update, context: CallbackContext) -> None:
 def successful_payment_callback(update: Update, context: CallbackContext) -> None:
     try:
         payload = update.message.successful_payment.invoice_payload
-        user, _, _ = get_user_data(update, context)
+        user, _ = get_user_data(update, context)
         new_expiry_date = datetime.today() + relativedelta(months=+1)
+        # apply all changes in one update, so that a payment is never half-applied
         if "extension" in payload and "basic" in payload:
-            set_user_config(user, Config.PLAN, 'basic')
-            # reset settings in case user downgraded
-            set_user_config(user, Config.AUTO_CHECKOUT, False)
-            # extend account
-            set_user_expiry_date(user, new_expiry_date.strftime("%Y-%m-%d"))
+            # reset settings in case user downgraded and extend account
+            update_user(user, config={Config.PLAN: 'basic', Config.AUTO_CHECKOUT: False},
+                        fields={"expiry_date": new_expiry_date.strftime("%Y-%m-%d")})
         elif "extension" in payload and "premium" in payload:
-            set_user_config(user, Config.PLAN, 'premium')
             # extend account
-            set_user_expiry_date(user, new_expiry_date.strftime("%Y-%m-%d"))
+            update_user(user, config={Config.PLAN: 'premium'},
+                        fields={"expiry_date": new_expiry_date.strftime("%Y-%m-%d")})
         elif "upgrade" in payload and "premium" in payload:
             set_user_config(user, Config.PLAN, 'premium')
         else:
@@ -619,6 +639,8 @@ def error_handler(update: object, context: CallbackContext) -> None:
 
 
 def main() -> None:
+    ensure_db_indexes()
+
     # Create the Updater and pass it your bot's token.
     persistence = PicklePersistence(
         filename=config['telegram_persistence_file'])
@@ -696,6 +718,7 @@ def main() -> None:
     # SIGTERM or SIGABRT. This should be used most of the time, since
     # start_polling() is non-blocking and will stop the bot gracefully.
     updater.idle()
+    close_db_client()
 
 
 if __name__ == '__main__':
@@ -0,0 +1,6 @@
+import os
+import sys
+
+# the bot is not installed as package, but run from its directory
+sys.path.insert(0, os.path.join(os.path.dirname(
+    os.path.realpath(__file__)), '..', 'src', 'opt', 'ecuagenera-bot'))
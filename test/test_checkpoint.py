@@ -0,0 +1,34 @@
+import json
+import os
+
+from ecua_utils.checkpoint import CrawlCheckpoint
+
+
+def test_resume_interrupted_cycle(tmp_path):
+    path = os.path.join(tmp_path, 'crawl_checkpoint.json')
+    checkpoint = CrawlCheckpoint(path)
+    assert not checkpoint.start('curl', 3600)
+    checkpoint.set_user_done('a@example.com')
+    checkpoint.save()
+
+    checkpoint = CrawlCheckpoint(path)
+    assert checkpoint.start('curl', 3600)
+    assert checkpoint.is_user_done('a@example.com')
+    checkpoint.complete()
+    assert not CrawlCheckpoint(path).start('curl', 3600)
+
+
+def test_not_persistent_checkpoint_keeps_file(tmp_path):
+    path = os.path.join(tmp_path, 'crawl_checkpoint.json')
+    checkpoint = CrawlCheckpoint(path)
+    checkpoint.start('curl', 3600)
+    checkpoint.set_user_done('a@example.com')
+    checkpoint.save()
+
+    # e.g. a --email run
+    single = CrawlCheckpoint(path, persistent=False)
+    assert not single.start('curl', 3600)
+    single.complete()
+
+    with open(path, 'r') as f:
+        assert 'a@example.com' in json.load(f)['users_done']
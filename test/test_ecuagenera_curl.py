@@ -0,0 +1,88 @@
+import json
+
+from ecuagenera_curl import EcuageneraCurl
+
+
+class FakeResponse:
+    def __init__(self, status_code: int, text: str):
+        self.status_code = status_code
+        self.text = text
+        self.headers = {}
+
+    def json(self):
+        return json.loads(self.text)
+
+
+# Returns an EcuageneraCurl which fetches directly and gets `text` for every page
+def get_curl(text: str, status_code: int = 200) -> EcuageneraCurl:
+    ec = EcuageneraCurl()
+    ec.direct_ready = True
+    ec.http.get = lambda url, headers=None, timeout=None: FakeResponse(
+        status_code, text)
+    return ec
+
+
+def test_maintenance_page_is_failed_fetch():
+    product = get_curl('<html><h1>maintenance</h1></html>').fetch_product('PIE2081')
+    assert not product['valid']
+    assert not product['available']
+    assert product['name'] != 'PIE2081'
+
+
+def test_product_page():
+    html = '<div class="ProductDetails"><h1 itemprop="name">Anthurium regale</h1>' \
+        '<span class="ProductOnStockIcon"></span></div>'
+    product = get_curl(html).fetch_product('PIE2081')
+    assert product['valid']
+    assert product['available']
+    assert product['name'] == 'Anthurium regale'
+
+
+class FakeFlaresolverr:
+    """Keeps sessions like flaresolverr, `restart()` forgets them (like a restarted container)."""
+
+    def __init__(self):
+        self.sessions = set()
+        self.created = 0
+
+    def restart(self):
+        self.sessions = set()
+
+    def cmd(self, payload: dict) -> FakeResponse:
+        if payload['cmd'] == 'sessions.create':
+            self.created += 1
+            session = f'session-{self.created}'
+            self.sessions.add(session)
+            return FakeResponse(200, f'{{"session": "{session}"}}')
+        if payload['cmd'] == 'sessions.destroy':
+            self.sessions.discard(payload['session'])
+            return FakeResponse(200, '{}')
+        if 'session' in payload and payload['session'] not in self.sessions:
+            return FakeResponse(500, '{"status": "error", "message": "This session does not exist."}')
+        return FakeResponse(200, '{"solution": {"response": "<div class=\\"ProductDetails\\"></div>", '
+                            '"cookies": [], "userAgent": "test"}}')
+
+
+def test_lost_sessions_are_recreated():
+    flaresolverr = FakeFlaresolverr()
+    ec = EcuageneraCurl(sessions=2, direct=False)
+    ec.flaresolverr_cmd = flaresolverr.cmd
+    with ec:
+        flaresolverr.restart()
+
+        for i in range(10):
+            html, _, _ = ec.request_item_page(f'PIE{i}')
+            assert html is not None
+    # both dead sessions were replaced once
+    assert flaresolverr.created == 4
+
+
+def test_not_available_page_is_not_found():
+    product = get_curl('<p>The page requested is not available.</p>').fetch_product('PIE2081')
+    assert not product['valid']
+    assert product['not_found']
+
+
+def test_failed_fetch_is_not_not_found():
+    product = get_curl('<html><h1>maintenance</h1></html>').fetch_product('PIE2081')
+    assert not product['not_found']
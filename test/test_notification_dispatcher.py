@@ -0,0 +1,21 @@
+from ecua_utils.notification_dispatcher import (STATUS_DELIVERED,
+                                                NotificationDispatcher)
+
+
+class FakeBot:
+    def __init__(self):
+        self.sent = []
+
+    def send_message(self, chat_id, text):
+        self.sent.append((chat_id, text))
+
+
+def test_failing_callback_keeps_delivered_status():
+    def on_delivered(status):
+        raise NameError('stock_state')
+
+    bot = FakeBot()
+    with NotificationDispatcher(bot, workers=2) as dispatcher:
+        dispatcher.enqueue('a@example.com', 1, 'hi', on_delivered=on_delivered)
+        assert dispatcher.drain() == {STATUS_DELIVERED: 1}
+    assert bot.sent == [(1, 'hi')]
@@ -0,0 +1,54 @@
+import os
+
+import pytest
+
+from ecua_utils.product_parser import is_product_page, parse_product_page
+
+PAGES_DIR = os.path.join(os.path.dirname(
+    os.path.realpath(__file__)), '..', 'bench', 'pages')
+
+
+def read_page(name: str) -> str:
+    with open(os.path.join(PAGES_DIR, f'{name}.html'), 'r') as f:
+        return f.read()
+
+
+def test_in_stock_page():
+    product = parse_product_page(read_page('in_stock'))
+    assert product['valid']
+    assert product['available']
+    assert product['name'] == 'Anthurium regale'
+    assert product['price'] == '45.00'
+    assert product['quantities'] == ['1', '2']
+
+
+def test_out_of_stock_page():
+    product = parse_product_page(read_page('out_of_stock'))
+    assert product['valid']
+    assert not product['available']
+    assert product['name'] is not None
+
+
+def test_not_available_page():
+    product = parse_product_page(read_page('not_available'))
+    assert not product['valid']
+    assert not product['available']
+
+
+@pytest.mark.parametrize('html', [
+    '<html><h1>maintenance</h1></html>',
+    '<html><body><p>Internal Server Error</p></body></html>',
+    '',
+])
+def test_other_pages_are_no_products(html):
+    assert not is_product_page(html)
+    product = parse_product_page(html)
+    assert not product['valid']
+    assert not product['available']
+    assert product['name'] is None
+
+
+def test_sign_in_page_is_no_product():
+    product = parse_product_page(read_page('sign_in'))
+    assert not product['valid']
+    assert not product['available']